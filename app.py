@@ -1,18 +1,25 @@
 from src.auth import auth_bp
 from flask import Flask, render_template, jsonify, request, stream_with_context, Response, redirect, session
 from flask_login import LoginManager, login_required, current_user
-from src.database import db, User, Conversation, Message, Document, DocumentChunk, Citation, Feedback
-from src.helper import download_hugging_face_embeddings, load_single_pdf, filter_to_minimal_docs, text_split
-from langchain_pinecone import PineconeVectorStore
+from src.database import db, User, Conversation, Message, Document, DocumentChunk, Citation, Feedback, DocumentStatus, upgrade_schema, schema_lock
+from sqlalchemy.orm import selectinload
+from src.helper import download_hugging_face_embeddings
+from src.vector_store import get_vector_store, VECTOR_STORE_BACKEND
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
 from src.prompt import system_prompt_with_citations
-from src.rag_advanced import rewrite_query, multi_hop_reasoning
+from src.rag_advanced import retrieve_with_rewrite, multi_hop_reasoning_stream
+from src.retrieval import parallel_retrieve, user_scope_filter
+from src.cache import SemanticAnswerCache, answer_cache_scope
+from src.persistence import WriteBehindQueue
+from src.ingestion import (IngestionQueue, get_progress, file_sha256, delete_document_vectors,
+                           fail_stale_documents, fail_if_stale, stale_ingestion)
 import os
 import json
 import uuid
+import time
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import tempfile
@@ -36,11 +43,54 @@ app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp(
 ) if IS_TESTING else 'data/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# "dual": separate global and per-user queries; "single": one query with a
+# user_id OR-filter (requires global vectors tagged user_id="global")
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'dual')
+GLOBAL_TOP_K = 5
+USER_TOP_K = 8
+# Sub-questions explored by advanced RAG; they are retrieved concurrently
+ADVANCED_RAG_MAX_HOPS = int(os.environ.get('ADVANCED_RAG_MAX_HOPS', 2))
+
+# Upper bound for ?limit= on the conversation messages endpoint
+MESSAGES_PAGE_MAX = 200
+
+# Assistant messages and citations are written by a background worker after
+# the final SSE events are sent (PERSIST_WORKERS=0 writes inline)
+PERSIST_WORKERS = int(os.environ.get(
+    'PERSIST_WORKERS', 0 if IS_TESTING else 1))
+PERSIST_QUEUE_SIZE = int(os.environ.get('PERSIST_QUEUE_SIZE', 256))
+
+# Uploads are indexed by background workers; PDF page ranges are extracted on
+# a shared process pool (INGEST_WORKERS=0 runs jobs inline,
+# INGEST_PARSE_PROCESSES=0 gives each upload its own PDF_PARSE_PROCESSES pool)
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 0 if IS_TESTING else 2))
+INGEST_PARSE_PROCESSES = int(os.environ.get(
+    'INGEST_PARSE_PROCESSES', 0 if IS_TESTING else 2))
+# Seconds between checks, and maximum lifetime, of an ingestion progress stream.
+# A stream occupies a gunicorn thread (gthread workers, see Dockerfile), so it
+# is recycled well within the worker timeout (--timeout 120) and the browser
+# reconnects after PROGRESS_RETRY_MS
+PROGRESS_POLL_INTERVAL = 0.5
+PROGRESS_STREAM_TIMEOUT = 45
+PROGRESS_RETRY_MS = 1000
+
+# Semantic answer cache (ANSWER_CACHE_SIZE=0 disables it)
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', 256))
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.environ.get('ANSWER_CACHE_THRESHOLD', 0.95)),
+    ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600)),
+    max_entries=ANSWER_CACHE_SIZE
+) if ANSWER_CACHE_SIZE else None
+
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 load_dotenv()
 
 db.init_app(app)
+persistence = WriteBehindQueue(
+    app, maxsize=PERSIST_QUEUE_SIZE, workers=PERSIST_WORKERS)
+ingestion = IngestionQueue(
+    app, workers=INGEST_WORKERS, parse_processes=INGEST_PARSE_PROCESSES)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
@@ -91,12 +141,13 @@ else:
     PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
     GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
 
-    if not PINECONE_API_KEY:
+    if not PINECONE_API_KEY and VECTOR_STORE_BACKEND == 'pinecone':
         raise ValueError("PINECONE_API_KEY not found in environment variables")
     if not GOOGLE_API_KEY:
         raise ValueError("GOOGLE_API_KEY not found in environment variables")
 
-    os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
+    if PINECONE_API_KEY:
+        os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
     os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
 
     print("Initializing embeddings model...")
@@ -122,18 +173,16 @@ else:
         print(f"✗ Failed to initialize Gemini LLM: {e}")
         raise
 
-    print("Connecting to Pinecone vector store...")
+    print(f"Connecting to vector store (backend: {VECTOR_STORE_BACKEND})...")
     try:
-        docsearch = PineconeVectorStore.from_existing_index(
-            index_name=index_name,
-            embedding=embeddings
-        )
+        docsearch = get_vector_store(embeddings, index_name)
         retriever = docsearch.as_retriever(
-            search_type="similarity", search_kwargs={"k": 5})
-        print("✓ Pinecone connection established successfully")
+            search_type="similarity", search_kwargs={"k": GLOBAL_TOP_K})
+        print("✓ Vector store connection established successfully")
     except Exception as e:
-        print(f"✗ Failed to connect to Pinecone: {e}")
-        print("  Make sure your PINECONE_API_KEY is valid and the index 'medical-chatbot' exists")
+        print(f"✗ Failed to connect to vector store: {e}")
+        if VECTOR_STORE_BACKEND == 'pinecone':
+            print("  Make sure your PINECONE_API_KEY is valid and the index 'medical-chatbot' exists")
         raise
 
 
@@ -208,6 +257,67 @@ def documents():
     return render_template('documents.html', documents=existing_docs)
 
 
+def _metadata_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_citation_rows(message_id, retrieved_docs):
+    """Citation rows for `retrieved_docs`, resolved from their vector metadata.
+
+    Uploaded chunks carry `document_id`/`chunk_id` in their metadata, so the
+    IDs are validated with one query instead of being looked up per citation.
+    IDs whose document or chunk has since been deleted are stored as None.
+    """
+    doc_ids = {_metadata_int(d.metadata.get('document_id'))
+               for d in retrieved_docs} - {None}
+    chunk_ids = {_metadata_int(d.metadata.get('chunk_id'))
+                 for d in retrieved_docs} - {None}
+
+    valid_docs, valid_chunks = set(), set()
+    if doc_ids:
+        rows = db.session.query(Document.id, DocumentChunk.id)\
+            .outerjoin(DocumentChunk, db.and_(
+                DocumentChunk.document_id == Document.id,
+                DocumentChunk.id.in_(chunk_ids or [-1])))\
+            .filter(Document.id.in_(doc_ids)).all()
+        for doc_id, chunk_id in rows:
+            valid_docs.add(doc_id)
+            if chunk_id is not None:
+                valid_chunks.add((doc_id, chunk_id))
+
+    citation_rows = []
+    for doc in retrieved_docs:
+        doc_id = _metadata_int(doc.metadata.get('document_id'))
+        chunk_id = _metadata_int(doc.metadata.get('chunk_id'))
+        citation_rows.append({
+            'message_id': message_id,
+            'document_id': doc_id if doc_id in valid_docs else None,
+            'chunk_id': chunk_id if (doc_id, chunk_id) in valid_chunks else None,
+            'page_number': _metadata_int(doc.metadata.get('page')),
+            'relevance_score': 0.8,
+            'content_snippet': doc.page_content[:200]
+        })
+    return citation_rows
+
+
+def persist_answer(message_id, content, retrieved_docs):
+    """Write-behind job: fill in a reserved assistant message and its citations"""
+    Message.query.filter_by(id=message_id).update({'content': content})
+    citation_rows = build_citation_rows(message_id, retrieved_docs)
+    if citation_rows:
+        db.session.execute(db.insert(Citation), citation_rows)
+    db.session.commit()
+
+
+def discard_unanswered(message_id):
+    """Write-behind job: drop a reserved assistant message that got no answer"""
+    Message.query.filter_by(id=message_id, content='').delete()
+    db.session.commit()
+
+
 @app.route("/api/chat/stream", methods=["POST", "GET", "OPTIONS"])
 @login_required
 def chat_stream():
@@ -244,31 +354,58 @@ def chat_stream():
         role='user',
         content=user_message
     )
-    db.session.add(user_msg)
+    # The assistant row is reserved in the same commit so its ID can go out
+    # with the done event while the answer itself is persisted write-behind
+    assistant_msg = Message(
+        conversation_id=conversation_id,
+        role='assistant',
+        content=''
+    )
+    db.session.add_all([user_msg, assistant_msg])
     db.session.commit()
 
     user_id = current_user.id
+    assistant_msg_id = assistant_msg.id
 
     def generate():
+        request_start = time.perf_counter()
+        timings = {}
+        answered = False
         try:
             yield "data: {\"type\": \"heartbeat\"}\n\n"
 
             allowed_user_ids = {str(user_id), "global", None}
 
-            user_docs = Document.query.filter_by(
-                user_id=user_id, is_indexed=True).all()
-            user_retriever = docsearch.as_retriever(
-                search_type="similarity",
-                search_kwargs={
-                    "k": 8,
-                    "filter": {"user_id": str(user_id)}
-                }
-            ) if user_docs else None
+            # Documents still being indexed already have searchable chunks,
+            # so they count towards the cache scope like indexed ones
+            visible_docs = [d for d in Document.query.filter(
+                Document.user_id == user_id, Document.status != DocumentStatus.FAILED)
+                if not fail_if_stale(docsearch, d)]
+            user_docs = [
+                d for d in visible_docs if d.status == DocumentStatus.INDEXED]
+            if RETRIEVAL_MODE == 'single':
+                scoped_retriever = docsearch.as_retriever(
+                    search_type="similarity",
+                    search_kwargs={
+                        "k": GLOBAL_TOP_K + (USER_TOP_K if user_docs else 0),
+                        "filter": user_scope_filter(user_id)
+                    }
+                )
+                print(
+                    f"Retriever ready. User docs: {len(user_docs)}. Using single scoped (global + user) retrieval.")
+            else:
+                user_retriever = docsearch.as_retriever(
+                    search_type="similarity",
+                    search_kwargs={
+                        "k": USER_TOP_K,
+                        "filter": {"user_id": str(user_id)}
+                    }
+                ) if user_docs else None
 
-            base_retriever = retriever
+                base_retriever = retriever
 
-            print(
-                f"Retrievers ready. User docs: {len(user_docs)}. Using global + user-specific retrieval.")
+                print(
+                    f"Retrievers ready. User docs: {len(user_docs)}. Using global + user-specific retrieval.")
 
             def filter_allowed(docs):
                 filtered = [
@@ -277,39 +414,59 @@ def chat_stream():
                 ]
                 return filtered
 
-            if use_advanced_rag:
+            def retrieve_docs(query):
+                if RETRIEVAL_MODE == 'single':
+                    return filter_allowed(scoped_retriever.invoke(query))
+                base_res, user_res = parallel_retrieve(
+                    [base_retriever, user_retriever], query)
+                return filter_allowed(base_res) + filter_allowed(user_res)
+
+            cache_scope = answer_cache_scope(
+                user_id, [d.id for d in visible_docs], use_advanced_rag)
+            query_vector = None
+            cached = None
+            if answer_cache is not None and embeddings is not None:
+                query_vector = embeddings.embed_query(user_message)
+                cached = answer_cache.lookup(cache_scope, query_vector)
+
+            if cached is not None:
+                print(
+                    f"Answer cache hit (similarity {cached['similarity']:.3f}) for user {user_id}")
+                retrieved_docs = cached["docs"]
+                answer = cached["answer"]
+                yield f"data: {json.dumps({'type': 'token', 'content': answer})}\n\n"
+            elif use_advanced_rag:
                 def filtered_retrieve(query):
-                    docs = []
-                    base_docs = base_retriever.invoke(query)
-                    docs.extend(filter_allowed(base_docs))
-                    if user_retriever:
-                        user_docs_res = user_retriever.invoke(query)
-                        docs.extend(filter_allowed(user_docs_res))
+                    docs = retrieve_docs(query)
 
                     print(
                         f"Advanced RAG: Retrieved {len(docs)} combined docs (global + user) for user {user_id}")
                     return docs
 
-                result = multi_hop_reasoning(
-                    llm, filtered_retrieve, user_message, max_hops=2)
-                retrieved_docs = result["context_used"]
-                answer = result["answer"]
+                answer = ""
+                for event in multi_hop_reasoning_stream(
+                        llm, filtered_retrieve, user_message, max_hops=ADVANCED_RAG_MAX_HOPS):
+                    if event["type"] == "status":
+                        yield f"data: {json.dumps({'type': 'status', 'stage': event['stage'], 'message': event['message']})}\n\n"
+                    elif event["type"] == "token":
+                        if 'first_token_ms' not in timings:
+                            timings['first_token_ms'] = round(
+                                (time.perf_counter() - request_start) * 1000, 1)
+                        yield f"data: {json.dumps({'type': 'token', 'content': event['content']})}\n\n"
+                    else:
+                        retrieved_docs = event["context_used"]
+                        answer = event["answer"]
             else:
-                rewritten_query = rewrite_query(llm, user_message)
-
-                retrieved_docs = []
-
-                base_docs = base_retriever.invoke(rewritten_query)
-                base_docs = filter_allowed(base_docs)
-                retrieved_docs.extend(base_docs)
-
-                if user_retriever:
-                    user_docs_res = user_retriever.invoke(rewritten_query)
-                    user_docs_res = filter_allowed(user_docs_res)
-                    retrieved_docs.extend(user_docs_res)
+                retrieved_docs, rewritten_query = retrieve_with_rewrite(
+                    llm, retrieve_docs, user_message, timings=timings)
+                print(
+                    f"Query rewrite: {timings['rewrite']} ({timings['rewrite_ms']} ms), retrieval {timings['retrieval_ms']} ms, query: {rewritten_query!r}")
+                user_hits = sum(
+                    1 for d in retrieved_docs
+                    if d.metadata.get('user_id') == str(user_id))
 
                 print(
-                    f"Retrieved {len(retrieved_docs)} documents total (global + user). Global: {len(base_docs)}, User: {len(user_docs_res) if user_retriever else 0}")
+                    f"Retrieved {len(retrieved_docs)} documents total (global + user). Global: {len(retrieved_docs) - user_hits}, User: {user_hits}")
 
                 for i, doc in enumerate(retrieved_docs[:3]):
                     print(f"  Doc {i+1}: source={doc.metadata.get('source', 'Unknown')}, user_id={doc.metadata.get('user_id', 'Unknown')}, document_id={doc.metadata.get('document_id', 'Unknown')}")
@@ -331,52 +488,30 @@ def chat_stream():
                     ("human", "{input}"),
                 ])
                 chain = prompt | llm | StrOutputParser()
-                answer = chain.invoke(
-                    {"input": user_message, "context": formatted_context})
+                answer = ""
+                generation_start = time.perf_counter()
+                for chunk in chain.stream(
+                        {"input": user_message, "context": formatted_context}):
+                    if not chunk:
+                        continue
+                    if not answer:
+                        timings['first_token_ms'] = round(
+                            (time.perf_counter() - request_start) * 1000, 1)
+                    answer += chunk
+                    yield f"data: {json.dumps({'type': 'token', 'content': chunk})}\n\n"
+                timings['generation_ms'] = round(
+                    (time.perf_counter() - generation_start) * 1000, 1)
                 print(f"Generated answer length: {len(answer)} characters")
 
-            words = answer.split()
-            full_answer = ""
-            for word in words:
-                full_answer += word + " "
-                yield f"data: {json.dumps({'type': 'token', 'content': word + ' '})}\n\n"
-
-            assistant_msg = Message(
-                conversation_id=conversation_id,
-                role='assistant',
-                content=full_answer.strip()
-            )
-            db.session.add(assistant_msg)
-            db.session.flush()
-
-            for i, doc in enumerate(retrieved_docs):
-                source = doc.metadata.get('source', 'Unknown')
-                page = doc.metadata.get('page')
-
-                doc_id = None
-                chunk_id = None
-
-                doc_obj = Document.query.filter_by(file_path=source).first()
-                if doc_obj:
-                    doc_id = doc_obj.id
-                    chunk_obj = DocumentChunk.query.filter_by(
-                        document_id=doc_id,
-                        page_number=page
-                    ).first()
-                    if chunk_obj:
-                        chunk_id = chunk_obj.id
-
-                citation = Citation(
-                    message_id=assistant_msg.id,
-                    document_id=doc_id,
-                    chunk_id=chunk_id,
-                    page_number=page,
-                    relevance_score=0.8,
-                    content_snippet=doc.page_content[:200]
-                )
-                db.session.add(citation)
-
-            db.session.commit()
+            # Answers built on a half-indexed upload would outlive its indexing,
+            # and the user's own chunks must never land in the shared scope
+            # (e.g. vectors left behind by a failed cleanup)
+            cacheable = len(user_docs) == len(visible_docs) and not (
+                cache_scope[0] == "global" and
+                any(d.metadata.get('user_id') == str(user_id) for d in retrieved_docs))
+            if cached is None and query_vector is not None and answer.strip() and cacheable:
+                answer_cache.store(cache_scope, query_vector,
+                                   answer, retrieved_docs)
 
             citations_data = []
             for i, doc in enumerate(retrieved_docs):
@@ -391,7 +526,15 @@ def chat_stream():
                 })
 
             yield f"data: {json.dumps({'type': 'citations', 'citations': citations_data, 'conversation_id': conversation_id})}\n\n"
-            yield f"data: {json.dumps({'type': 'done', 'message_id': assistant_msg.id})}\n\n"
+
+            persistence.submit(persist_answer, assistant_msg_id,
+                               answer.strip(), retrieved_docs)
+            answered = True
+
+            timings['total_ms'] = round(
+                (time.perf_counter() - request_start) * 1000, 1)
+            print(f"Chat timings for user {user_id}: {timings}")
+            yield f"data: {json.dumps({'type': 'done', 'message_id': assistant_msg_id, 'timings': timings})}\n\n"
 
         except Exception as e:
             import traceback
@@ -399,6 +542,10 @@ def chat_stream():
             print(f"Error in chat_stream: {error_msg}")
             print(traceback.format_exc())
             yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
+        finally:
+            # Also runs when the client disconnects (GeneratorExit) mid-answer
+            if not answered:
+                persistence.submit(discard_unanswered, assistant_msg_id)
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
         'Cache-Control': 'no-cache',
@@ -412,19 +559,27 @@ def get_conversations():
     """Get user's conversations"""
     if not session.get('_user_id') or not current_user.is_authenticated:
         return jsonify({"error": "Unauthorized"}), 401
-    conversations = Conversation.query.filter_by(user_id=current_user.id)\
+    # Count and preview come from correlated subqueries, so the sidebar is
+    # one round trip and only 100 characters of one message per row are read.
+    # Assistant rows reserved for answers not yet persisted are empty and skipped
+    message_count = db.select(db.func.count(Message.id))\
+        .where(Message.conversation_id == Conversation.id, Message.content != '')\
+        .correlate(Conversation).scalar_subquery()
+    preview = db.select(db.func.substr(Message.content, 1, 100))\
+        .where(Message.conversation_id == Conversation.id, Message.content != '')\
+        .order_by(Message.created_at, Message.id).limit(1)\
+        .correlate(Conversation).scalar_subquery()
+    rows = db.session.query(
+        Conversation.id, Conversation.created_at, message_count, preview)\
+        .filter(Conversation.user_id == current_user.id)\
         .order_by(Conversation.updated_at.desc()).limit(20).all()
 
-    result = []
-    for conv in conversations:
-        messages = Message.query.filter_by(
-            conversation_id=conv.id).order_by(Message.created_at).all()
-        result.append({
-            'id': conv.id,
-            'created_at': conv.created_at.isoformat(),
-            'message_count': len(messages),
-            'preview': messages[0].content[:100] if messages else ''
-        })
+    result = [{
+        'id': conv_id,
+        'created_at': created_at.isoformat(),
+        'message_count': count,
+        'preview': first_message or ''
+    } for conv_id, created_at, count, first_message in rows]
 
     return jsonify(result)
 
@@ -440,8 +595,42 @@ def get_messages(conversation_id):
     if not conversation:
         return jsonify({"error": "Conversation not found"}), 404
 
-    messages = Message.query.filter_by(conversation_id=conversation_id)\
-        .order_by(Message.created_at).all()
+    # Optional keyset pagination: ?limit=N returns the newest N messages and
+    # ?before=<message_id> continues with the ones preceding that message
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    lite = request.args.get('lite', '').lower() in ('1', 'true')
+    if limit is not None:
+        limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+
+    # Citations and feedback are batch-loaded per relationship and documents
+    # with one IN-list, so the query count does not grow with the history.
+    # Reserved assistant rows stay empty until the write-behind queue fills them
+    query = Message.query.filter(Message.conversation_id == conversation_id, Message.content != '')\
+        .options(selectinload(Message.citations), selectinload(Message.feedback))
+    if before is not None:
+        cursor = db.session.query(Message.created_at, Message.id)\
+            .filter_by(id=before, conversation_id=conversation_id).first()
+        if not cursor:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(db.or_(
+            Message.created_at < cursor.created_at,
+            db.and_(Message.created_at == cursor.created_at, Message.id < cursor.id)))
+
+    has_more = False
+    if limit is None:
+        messages = query.order_by(Message.created_at, Message.id).all()
+    else:
+        messages = query.order_by(Message.created_at.desc(), Message.id.desc())\
+            .limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+
+    document_ids = {cit.document_id for msg in messages
+                    for cit in msg.citations if cit.document_id}
+    document_names = dict(db.session.query(
+        Document.id, Document.original_filename)
+        .filter(Document.id.in_(document_ids)).all()) if document_ids else {}
 
     result = []
     for msg in messages:
@@ -453,28 +642,26 @@ def get_messages(conversation_id):
         }
 
         if msg.role == 'assistant':
-            citations = Citation.query.filter_by(message_id=msg.id).all()
             msg_data['citations'] = []
-            for cit in citations:
-                source_name = 'Unknown'
-                if cit.document_id:
-                    doc = Document.query.get(cit.document_id)
-                    if doc:
-                        source_name = doc.original_filename
-                msg_data['citations'].append({
+            for cit in msg.citations:
+                citation_data = {
                     'id': cit.id,
-                    'source': source_name,
-                    'page': cit.page_number,
-                    'preview': cit.content_snippet
-                })
+                    'source': document_names.get(cit.document_id, 'Unknown'),
+                    'page': cit.page_number
+                }
+                if not lite:
+                    citation_data['preview'] = cit.content_snippet
+                msg_data['citations'].append(citation_data)
 
-            feedback = Feedback.query.filter_by(message_id=msg.id).first()
-            if feedback:
-                msg_data['feedback'] = feedback.rating
+            if msg.feedback:
+                msg_data['feedback'] = msg.feedback.rating
 
         result.append(msg_data)
 
-    return jsonify(result)
+    response = jsonify(result)
+    if has_more:
+        response.headers['X-Next-Before'] = str(messages[0].id)
+    return response
 
 
 @app.route("/api/upload", methods=["POST"])
@@ -504,6 +691,29 @@ def upload_document():
         return jsonify({"error": "Only PDF files are supported"}), 400
 
     filename = secure_filename(file.filename)
+    content_hash = file_sha256(file.stream)
+
+    # The same user uploading the same file again gets the existing document,
+    # unless its ingestion job was lost
+    existing = Document.query.filter(
+        Document.user_id == current_user.id,
+        Document.content_hash == content_hash,
+        Document.status != DocumentStatus.FAILED,
+        ~stale_ingestion()
+    ).first()
+    if existing:
+        print(f"Upload of {filename} matches document {existing.id}, not re-indexing")
+        return jsonify({
+            "success": True,
+            "duplicate": True,
+            "job_id": existing.id,
+            "document": {
+                "id": existing.id,
+                "filename": existing.original_filename,
+                "status": existing.status
+            }
+        }), 200
+
     unique_filename = f"{uuid.uuid4()}_{filename}"
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
 
@@ -512,116 +722,117 @@ def upload_document():
     print(f"File saved successfully: {os.path.exists(file_path)}")
 
     try:
-        print(f"Loading PDF from: {file_path}")
-        documents = load_single_pdf(file_path)
-        print(f"Loaded {len(documents)} documents from PDF")
-        if documents:
-            print(
-                f"First document preview: {documents[0].page_content[:200]}...")
-
-        filtered_docs = filter_to_minimal_docs(documents)
-        print(f"After filtering: {len(filtered_docs)} documents")
-
-        text_chunks = text_split(filtered_docs)
-        print(f"After text splitting: {len(text_chunks)} chunks")
-
-        if len(text_chunks) == 0:
-            print(f"ERROR: No text chunks created! PDF might be empty or corrupted.")
-            return jsonify({"error": "PDF appears to be empty or could not be processed. Please check the file."}), 400
-
         doc = Document(
             user_id=current_user.id,
             filename=unique_filename,
             original_filename=filename,
             file_path=file_path,
             file_size=os.path.getsize(file_path),
-            is_indexed=False
+            content_hash=content_hash,
+            status=DocumentStatus.PENDING
         )
         db.session.add(doc)
-        db.session.flush()
-
-        chunk_objects = []
-        for i, chunk in enumerate(text_chunks):
-            chunk_obj = DocumentChunk(
-                document_id=doc.id,
-                chunk_index=i,
-                page_number=chunk.metadata.get('page', 0),
-                content_preview=chunk.page_content[:200]
-            )
-            chunk_objects.append(chunk_obj)
-            db.session.add(chunk_obj)
-
-        db.session.flush()
-
-        for chunk_obj in chunk_objects:
-            if chunk_obj.id is None:
-                print(f"Warning: chunk_obj.id is None after flush!")
-                db.session.refresh(chunk_obj)
-                print(f"After refresh: chunk_obj.id = {chunk_obj.id}")
-
-        from langchain_pinecone import PineconeVectorStore
-        vector_store = PineconeVectorStore.from_existing_index(
-            index_name=index_name,
-            embedding=embeddings
-        )
-
-        for chunk, chunk_obj in zip(text_chunks, chunk_objects):
-            clean_metadata = {}
+        db.session.commit()
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        print(f"Upload error: {error_msg}")
+        print(traceback.format_exc())
+        db.session.rollback()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return jsonify({"error": f"Error processing file: {error_msg}"}), 500
 
-            original_source = chunk.metadata.get('source', file_path)
-            clean_metadata['source'] = str(
-                original_source) if original_source else str(file_path)
+    # Parsing, embedding and upserting happen on the ingestion workers;
+    # the client follows progress via /api/documents/<id>/progress
+    ingestion.submit(doc.id, docsearch, on_indexed=invalidate_answer_cache)
+
+    return jsonify({
+        "success": True,
+        "job_id": doc.id,
+        "document": {
+            "id": doc.id,
+            "filename": filename,
+            "status": doc.status
+        }
+    }), 202
 
-            for key, value in chunk.metadata.items():
-                if key == 'source':
-                    continue
-                if value is not None:
-                    if isinstance(value, (str, int, float, bool)):
-                        clean_metadata[key] = value
-                    elif isinstance(value, list):
-                        clean_metadata[key] = [str(v)
-                                               for v in value if v is not None]
 
-            clean_metadata['document_id'] = str(doc.id)
-            if chunk_obj.id is not None:
-                clean_metadata['chunk_id'] = str(chunk_obj.id)
-            clean_metadata['user_id'] = str(current_user.id)
+def invalidate_answer_cache(doc):
+    if answer_cache is not None:
+        answer_cache.invalidate_user(doc.user_id)
 
-            page = clean_metadata.get('page', chunk.metadata.get('page', 0))
-            clean_metadata['page'] = int(page) if isinstance(
-                page, (int, float)) else 0
 
-            chunk.metadata = clean_metadata
+@app.route("/api/documents/<int:doc_id>/status", methods=["GET"])
+@login_required
+def document_status(doc_id):
+    """Ingestion status of an uploaded document"""
+    if not session.get('_user_id') or not current_user.is_authenticated:
+        return jsonify({"error": "Unauthorized"}), 401
+    doc = Document.query.filter_by(id=doc_id, user_id=current_user.id).first()
+    if not doc:
+        return jsonify({"error": "Document not found"}), 404
+    if fail_if_stale(docsearch, doc):
+        db.session.refresh(doc)
+
+    return jsonify({
+        "id": doc.id,
+        "filename": doc.original_filename,
+        "status": doc.status,
+        "error": doc.error,
+        "progress": get_progress(doc.id) or doc.progress,
+        "chunks": DocumentChunk.query.filter_by(document_id=doc.id).count()
+    })
 
-            print(
-                f"Chunk metadata: source={clean_metadata.get('source')}, document_id={clean_metadata.get('document_id')}, user_id={clean_metadata.get('user_id')}, page={clean_metadata.get('page')}")
 
-        print(
-            f"Adding {len(text_chunks)} chunks to Pinecone for user {current_user.id}")
-        vector_store.add_documents(text_chunks)
-        print(f"Successfully added documents to Pinecone")
+@app.route("/api/documents/<int:doc_id>/progress", methods=["GET"])
+@login_required
+def document_progress(doc_id):
+    """Stream ingestion progress of a document as Server-Sent Events"""
+    if not session.get('_user_id') or not current_user.is_authenticated:
+        return jsonify({"error": "Unauthorized"}), 401
+    if not Document.query.filter_by(id=doc_id, user_id=current_user.id).first():
+        return jsonify({"error": "Document not found"}), 404
 
-        doc.is_indexed = True
-        db.session.commit()
+    def read_state():
+        # Counters of a job running in this process are live; otherwise use
+        # the snapshot the ingesting worker last saved
+        columns = (Document.id, Document.status, Document.error, Document.progress,
+                   Document.updated_at, Document.uploaded_at)
+        row = db.session.query(*columns).filter_by(id=doc_id).first()
+        if row is not None and fail_if_stale(docsearch, row):
+            row = db.session.query(*columns).filter_by(id=doc_id).first()
+        db.session.rollback()
+        if row is None:
+            return None
+        live = get_progress(doc_id)
+        return {"status": row.status, "error": row.error, **(live or row.progress or {})}
 
-        return jsonify({
-            "success": True,
-            "document": {
-                "id": doc.id,
-                "filename": filename,
-                "chunks": len(text_chunks)
-            }
-        })
+    def generate():
+        last_state, last_sent = None, time.monotonic()
+        deadline = time.monotonic() + PROGRESS_STREAM_TIMEOUT
+        yield f"retry: {PROGRESS_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            state = read_state()
+            if state is None:
+                yield f"data: {json.dumps({'type': 'error', 'error': 'Document was deleted'})}\n\n"
+                return
+            if state["status"] in (DocumentStatus.INDEXED, DocumentStatus.FAILED):
+                yield f"data: {json.dumps({'type': 'done', **state})}\n\n"
+                return
+            if state != last_state:
+                yield f"data: {json.dumps({'type': 'progress', **state})}\n\n"
+                last_state, last_sent = state, time.monotonic()
+            elif time.monotonic() - last_sent > 15:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(PROGRESS_POLL_INTERVAL)
+        # Ending the response makes EventSource reconnect for a fresh stream
 
-    except Exception as e:
-        import traceback
-        error_msg = str(e)
-        print(f"Upload error: {error_msg}")
-        print(traceback.format_exc())
-        db.session.rollback()
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
-        return jsonify({"error": f"Error processing file: {error_msg}"}), 500
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 
 @app.route("/api/documents/<int:doc_id>", methods=["DELETE"])
@@ -658,25 +869,20 @@ def delete_document(doc_id):
         db.session.flush()
 
         try:
-            from pinecone import Pinecone
-            pc = Pinecone(api_key=PINECONE_API_KEY)
-            index = pc.Index(index_name)
-
-            delete_filter = {
-                "document_id": str(doc.id)
-            }
-            print(f"Deleting vectors from Pinecone for document_id={doc.id}")
-            index.delete(filter=delete_filter)
+            print(f"Deleting vectors from vector store for document_id={doc.id}")
+            delete_document_vectors(docsearch, doc)
             print(
-                f"Successfully deleted vectors from Pinecone for document {doc.id}")
+                f"Successfully deleted vectors from vector store for document {doc.id}")
         except Exception as e:
-            print(f"Warning: Could not delete vectors from Pinecone: {e}")
+            print(f"Warning: Could not delete vectors from vector store: {e}")
         if os.path.exists(doc.file_path):
             os.remove(doc.file_path)
             print(f"Deleted file: {doc.file_path}")
 
         db.session.delete(doc)
         db.session.commit()
+        if answer_cache is not None:
+            answer_cache.invalidate_user(current_user.id)
 
         return jsonify({"success": True})
     except Exception as e:
@@ -693,8 +899,6 @@ def delete_document(doc_id):
 def cleanup_pinecone():
     """Clean up orphaned vectors in Pinecone (vectors without corresponding documents in DB)"""
     try:
-        from pinecone import Pinecone
-
         user_docs = Document.query.filter_by(user_id=current_user.id).all()
         valid_document_ids = {str(doc.id) for doc in user_docs}
 
@@ -702,15 +906,12 @@ def cleanup_pinecone():
         print(
             f"Found {len(user_docs)} documents to delete (all user documents)")
 
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        index = pc.Index(index_name)
-
         user_filter = {"user_id": str(current_user.id)}
 
         deleted_count = 0
 
-        print(f"Deleting all vectors for user {current_user.id} from Pinecone")
-        index.delete(filter=user_filter)
+        print(f"Deleting all vectors for user {current_user.id} from vector store")
+        docsearch.delete(filter=user_filter)
         print(f"Deleted all vectors for user {current_user.id}")
 
         from src.database import Citation
@@ -749,6 +950,8 @@ def cleanup_pinecone():
 
         db.session.commit()
         print(f"Deleted {deleted_count} documents from database")
+        if answer_cache is not None:
+            answer_cache.invalidate_user(current_user.id)
 
         return jsonify({
             "success": True,
@@ -807,7 +1010,10 @@ def submit_feedback():
 with app.app_context():
     try:
         print("Initializing database...")
-        db.create_all()
+        with schema_lock():
+            db.create_all()
+            upgrade_schema()
+        fail_stale_documents(docsearch)
         print("✓ Database initialized successfully")
     except Exception as e:
         print(f"✗ Failed to initialize database: {e}")
@@ -0,0 +1 @@
+# Benchmark scripts (run from the project root, e.g. `python -m benchmarks.ann_recall`)
@@ -0,0 +1,89 @@
+"""
+Recall-vs-latency report for the local HNSW index.
+
+Builds HNSW graphs for each (M, ef_construction) pair, searches them with a
+range of ef_search values and compares the results against exact search, so
+LOCAL_INDEX_TYPE=hnsw settings can be picked with data.
+
+Usage:
+    python -m benchmarks.ann_recall
+    python -m benchmarks.ann_recall --index data/vector_index/medical-chatbot
+    python -m benchmarks.ann_recall --n 20000 --m 8 16 32 --ef-search 16 32 64 128
+"""
+from src.ann_index import HNSWIndex, recall_at_k
+from src.vector_store import LocalVectorStore
+import numpy as np
+import argparse
+import time
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 50, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to sentence embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    data = centres[rng.integers(0, clusters, n)] + rng.normal(scale=0.6, size=(n, dim))
+    return (data / np.linalg.norm(data, axis=1, keepdims=True)).astype(np.float32)
+
+
+def load_index_vectors(path: str) -> np.ndarray:
+    store = LocalVectorStore(None, path)
+    return np.asarray(store._vectors[np.nonzero(store._alive)[0]])
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int):
+    results, timings = [], []
+    for q in queries:
+        start = time.perf_counter()
+        scores = vectors @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        results.append(top[np.argsort(-scores[top])].tolist())
+        timings.append(time.perf_counter() - start)
+    return results, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="LocalVectorStore directory to read vectors from")
+    parser.add_argument("--n", type=int, default=5000, help="Synthetic vector count (without --index)")
+    parser.add_argument("--dim", type=int, default=384, help="Synthetic vector dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    args = parser.parse_args()
+
+    vectors = load_index_vectors(args.index) if args.index else synthetic_vectors(args.n, args.dim)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape)
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    exact, exact_times = exact_top_k(vectors, queries, args.k)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    print(f"exact scan: p50 {np.median(exact_times) * 1000:.2f} ms, "
+          f"p95 {np.percentile(exact_times, 95) * 1000:.2f} ms\n")
+    print(f"{'M':>4} {'ef_con':>7} {'build_s':>8} {'ef_search':>9} {'recall@k':>9} {'p50_ms':>8} {'p95_ms':>8}")
+
+    for m in args.m:
+        for ef_construction in args.ef_construction:
+            index = HNSWIndex(M=m, ef_construction=ef_construction)
+            start = time.perf_counter()
+            for row in range(len(vectors)):
+                index.add(row, vectors)
+            build_time = time.perf_counter() - start
+
+            for ef_search in args.ef_search:
+                approx, timings = [], []
+                for q in queries:
+                    start = time.perf_counter()
+                    hits = index.search(q, vectors, args.k, ef=ef_search)
+                    timings.append(time.perf_counter() - start)
+                    approx.append([row for _, row in hits])
+                print(f"{m:>4} {ef_construction:>7} {build_time:>8.1f} {ef_search:>9} "
+                      f"{recall_at_k(approx, exact):>9.3f} {np.median(timings) * 1000:>8.2f} "
+                      f"{np.percentile(timings, 95) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+PDF text extraction time: PyPDFLoader (one core) vs parallel page ranges.
+
+"before" is the old PyPDFLoader.load(); "after" is load_pdf_pages() with
+1, 2, 4, ... processes up to --processes. Pool start-up is included.
+
+Usage:
+    python -m benchmarks.pdf_parse --pdf data/Medical_book.pdf
+    python -m benchmarks.pdf_parse --pdf big.pdf --processes 8 --repeat 3
+"""
+from src.pdf_loader import load_pdf_pages
+import argparse
+import os
+import time
+
+
+def best_time(load, repeat):
+    best, pages = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = load()
+        best = min(best, time.perf_counter() - start)
+    return best, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", required=True)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from langchain_community.document_loaders import PyPDFLoader
+    baseline, reference = best_time(lambda: PyPDFLoader(args.pdf).load(), args.repeat)
+    print(f"{args.pdf}: {len(reference)} pages\n")
+    print(f"{'method':<16} {'best_s':>8} {'pages/s':>9} {'speedup':>8}")
+    print(f"{'PyPDFLoader':<16} {baseline:>8.2f} {len(reference) / baseline:>9.1f} {1.0:>7.1f}x")
+
+    processes = 1
+    while True:
+        elapsed, pages = best_time(lambda: load_pdf_pages(args.pdf, processes=processes), args.repeat)
+        assert [p.page_content for p in pages] == [p.page_content for p in reference]
+        print(f"{f'parallel x{processes}':<16} {elapsed:>8.2f} {len(pages) / elapsed:>9.1f} "
+              f"{baseline / elapsed:>7.1f}x")
+        if processes >= args.processes:
+            break
+        processes = min(processes * 2, args.processes)
+
+
+if __name__ == "__main__":
+    main()
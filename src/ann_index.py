@@ -0,0 +1,178 @@
+"""
+Approximate nearest-neighbour search: a small HNSW graph index in NumPy.
+
+The graph stores only node links; vectors stay in the caller's (usually
+memory-mapped) array and are looked up by row, so the index adds a few
+hundred bytes per vector on top of the vectors themselves. Deleted rows are
+tombstoned by the caller and skipped in results but still used for
+navigation, which keeps the graph connected without rebuilds.
+"""
+from typing import List, Optional, Callable, Dict, Any
+import numpy as np
+import heapq
+import math
+import os
+
+
+HNSW_M = int(os.environ.get('HNSW_M', 16))
+HNSW_EF_CONSTRUCTION = int(os.environ.get('HNSW_EF_CONSTRUCTION', 100))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', 64))
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph over unit-length vectors.
+
+    Args:
+        M: Links per node on upper layers (2*M on layer 0); higher = better recall, more memory
+        ef_construction: Candidate list size while inserting; higher = better graph, slower inserts
+        ef_search: Default candidate list size while searching; higher = better recall, slower queries
+        seed: Seed for level assignment
+    """
+
+    def __init__(self, M: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 ef_search: int = HNSW_EF_SEARCH, seed: int = 0):
+        self.M = M
+        self.max_links0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1 / math.log(max(M, 2))
+        self._rng = np.random.default_rng(seed)
+        self.links: List[List[List[int]]] = []  # node -> level -> neighbour rows
+        self.entry_point: Optional[int] = None
+        self.max_level = -1
+
+    def __len__(self):
+        return len(self.links)
+
+    def state(self) -> Dict[str, Any]:
+        return {"M": self.M, "ef_construction": self.ef_construction,
+                "ef_search": self.ef_search, "links": self.links,
+                "entry_point": self.entry_point, "max_level": self.max_level}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "HNSWIndex":
+        index = cls(state["M"], state["ef_construction"], state["ef_search"])
+        index.links = state["links"]
+        index.entry_point = state["entry_point"]
+        index.max_level = state["max_level"]
+        index._rng = np.random.default_rng(len(index.links))
+        return index
+
+    # ------------------------------------------------------------------ #
+    def _search_layer(self, query: np.ndarray, vectors, entry_points: List[int],
+                      ef: int, level: int) -> List[tuple]:
+        """Greedy best-first search on one layer; returns [(similarity, row)]"""
+        visited = set(entry_points)
+        sims = np.asarray(vectors[entry_points] @ query)
+        candidates = [(-float(s), n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_sim < results[0][0]:
+                break
+            neighbours = [n for n in self.links[node][level] if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for sim, n in zip(np.asarray(vectors[neighbours] @ query), neighbours):
+                sim = float(sim)
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, n))
+                    heapq.heappush(results, (sim, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbours(self, vectors, candidates: List[tuple], m: int) -> List[int]:
+        """HNSW heuristic: keep candidates closer to the node than to any kept neighbour"""
+        selected: List[int] = []
+        for sim, node in candidates:
+            if len(selected) >= m:
+                break
+            if selected:
+                to_selected = np.asarray(vectors[selected] @ np.asarray(vectors[node]))
+                if np.any(to_selected > sim):
+                    continue
+            selected.append(node)
+        if len(selected) < m:
+            chosen = set(selected)
+            selected += [n for _, n in candidates if n not in chosen][:m - len(selected)]
+        return selected
+
+    def add(self, row: int, vectors):
+        """Insert `row` (the next row of `vectors`) into the graph"""
+        if row != len(self.links):
+            raise ValueError(f"HNSW rows must be inserted in order (expected {len(self.links)}, got {row})")
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self.links.append([[] for _ in range(level + 1)])
+        if self.entry_point is None:
+            self.entry_point, self.max_level = row, level
+            return
+
+        query = np.asarray(vectors[row])
+        entry = [self.entry_point]
+        for lvl in range(self.max_level, level, -1):
+            entry = [self._search_layer(query, vectors, entry, 1, lvl)[0][1]]
+
+        for lvl in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(query, vectors, entry, self.ef_construction, lvl)
+            max_links = self.max_links0 if lvl == 0 else self.M
+            neighbours = self._select_neighbours(vectors, candidates, self.M)
+            self.links[row][lvl] = neighbours
+            for n in neighbours:
+                n_links = self.links[n][lvl]
+                n_links.append(row)
+                if len(n_links) > max_links:
+                    n_vec = np.asarray(vectors[n])
+                    sims = np.asarray(vectors[n_links] @ n_vec)
+                    order = np.argsort(-sims)
+                    self.links[n][lvl] = self._select_neighbours(
+                        vectors, [(float(sims[i]), n_links[i]) for i in order], max_links)
+            entry = [n for _, n in candidates]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = row, level
+
+    def search(self, query: np.ndarray, vectors, k: int, ef: Optional[int] = None,
+               accept: Optional[Callable[[int], bool]] = None) -> List[tuple]:
+        """
+        Approximate top-k by cosine similarity.
+
+        Args:
+            query: Unit-length query vector
+            vectors: Row-aligned vector array the graph was built over
+            k: Number of results
+            ef: Candidate list size (default: self.ef_search); must be >= k
+            accept: Optional predicate for rows allowed in results (tombstones, filters)
+
+        Returns:
+            [(similarity, row)] best first
+        """
+        if self.entry_point is None:
+            return []
+        ef = max(ef or self.ef_search, k)
+        entry = [self.entry_point]
+        for lvl in range(self.max_level, 0, -1):
+            entry = [self._search_layer(query, vectors, entry, 1, lvl)[0][1]]
+
+        while True:
+            results = self._search_layer(query, vectors, entry, ef, 0)
+            if accept is not None:
+                results = [r for r in results if accept(r[1])]
+            # Widen the search when tombstones/filters rejected too many rows
+            if len(results) >= k or ef >= len(self.links):
+                return results[:k]
+            ef *= 2
+
+
+def recall_at_k(approx: List[List[int]], exact: List[List[int]]) -> float:
+    """Fraction of exact top-k rows that the approximate search also returned"""
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    total = sum(len(e) for e in exact)
+    return hits / total if total else 1.0
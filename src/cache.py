@@ -0,0 +1,207 @@
+"""
+In-process caches shared across requests
+"""
+from langchain_core.embeddings import Embeddings
+from collections import OrderedDict
+from typing import List, Any, Optional, Hashable
+import numpy as np
+import threading
+import time
+
+
+_MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a query for cache keys: lowercase, single spaces"""
+    return " ".join(text.lower().split())
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with optional TTL and hit/miss counters.
+
+    Args:
+        maxsize: Maximum number of entries; least recently used are evicted first
+        ttl: Seconds an entry stays valid (None or 0 = no expiry)
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with an LRU cache in front of embed_query.
+
+    Queries are keyed on their normalized text, so repeated and trivially
+    different questions ("What is  Diabetes" / "what is diabetes") reuse one
+    vector. embed_documents is passed straight through: ingestion chunks are
+    rarely repeated and would only evict useful query entries.
+    """
+
+    def __init__(self, embeddings: Embeddings, maxsize: int = 2048, ttl: Optional[float] = None):
+        self.embeddings = embeddings
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(key)
+            self.cache.set(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's attributes (model_name, client, ...)
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+
+def answer_cache_scope(user_id, document_ids, advanced: bool = False) -> tuple:
+    """
+    Cache scope for a user's visible document set.
+
+    Users without indexed uploads only see the global corpus and share one
+    scope; anyone with uploads gets a scope tied to their user id and exact
+    document ids, so an upload or delete moves them to a fresh scope in
+    every worker process.
+    """
+    mode = "advanced" if advanced else "plain"
+    if not document_ids:
+        return ("global", mode)
+    return ("user", str(user_id), tuple(sorted(document_ids)), mode)
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache matched by query-embedding similarity within a scope.
+
+    Args:
+        threshold: Minimum cosine similarity for a hit
+        ttl: Seconds an answer stays valid (None or 0 = no expiry)
+        max_entries: Answers kept per scope (oldest evicted first)
+        max_scopes: Scopes kept (least recently used evicted first)
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: Optional[float] = 3600,
+                 max_entries: int = 256, max_scopes: int = 1024):
+        self.threshold = threshold
+        self.ttl = ttl or None
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self.hits = 0
+        self.misses = 0
+        self._scopes: "OrderedDict[tuple, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: tuple, vector) -> Optional[dict]:
+        """Return {"answer", "docs", "similarity"} for the closest live entry, or None"""
+        query = self._unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries:
+                entries[:] = [e for e in entries if e["expires_at"] is None or e["expires_at"] > now]
+            if not entries:
+                self.misses += 1
+                return None
+            self._scopes.move_to_end(scope)
+            sims = np.stack([e["vector"] for e in entries]) @ query
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = entries[best]
+            return {"answer": entry["answer"], "docs": list(entry["docs"]),
+                    "similarity": float(sims[best])}
+
+    def store(self, scope: tuple, vector, answer: str, docs: list):
+        entry = {
+            "vector": self._unit(vector),
+            "answer": answer,
+            "docs": list(docs),
+            "expires_at": time.monotonic() + self.ttl if self.ttl else None,
+        }
+        with self._lock:
+            entries = self._scopes.setdefault(scope, [])
+            self._scopes.move_to_end(scope)
+            entries.append(entry)
+            del entries[:-self.max_entries]
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """Drop every scope belonging to a user (after an upload or delete)"""
+        with self._lock:
+            for scope in [s for s in self._scopes if s[0] == "user" and s[1] == str(user_id)]:
+                del self._scopes[scope]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "scopes": len(self._scopes),
+            "entries": sum(len(e) for e in self._scopes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import DBAPIError
+from contextlib import contextmanager
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -29,9 +32,25 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
+class DocumentStatus:
+    """Ingestion states of a Document, in pipeline order"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    INDEXED = 'indexed'
+    FAILED = 'failed'
+
+    ALL = (PENDING, PROCESSING, INDEXED, FAILED)
+
+
 class Document(db.Model):
     """Document model for storing uploaded PDFs metadata"""
     __tablename__ = 'documents'
+    # Retrieval looks up a user's indexed documents on every chat message;
+    # uploads look for the same user's copy of a file by content hash
+    __table_args__ = (
+        db.Index('ix_documents_user_status', 'user_id', 'status'),
+        db.Index('ix_documents_user_content_hash', 'user_id', 'content_hash'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -39,8 +58,14 @@ class Document(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer)  # in bytes
+    content_hash = db.Column(db.String(64))  # SHA-256 of the file
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
-    is_indexed = db.Column(db.Boolean, default=False)
+    # Bumped by every status and progress write, so a stalled ingestion shows
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    status = db.Column(db.Enum(*DocumentStatus.ALL, name='document_status', native_enum=False),
+                       default=DocumentStatus.PENDING)
+    error = db.Column(db.Text)  # why ingestion failed
+    progress = db.Column(db.JSON)  # last ingestion counters, see src/ingestion.py
     
     chunks = db.relationship('DocumentChunk', backref='document', lazy=True, cascade='all, delete-orphan')
     
@@ -51,6 +76,12 @@ class Document(db.Model):
 class DocumentChunk(db.Model):
     """Store metadata about document chunks for citation"""
     __tablename__ = 'document_chunks'
+    # Chunks are read per document, optionally narrowed to one page, and
+    # looked up by text hash to reuse embeddings
+    __table_args__ = (
+        db.Index('ix_document_chunks_document_page', 'document_id', 'page_number'),
+        db.Index('ix_document_chunks_content_hash', 'content_hash'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
@@ -58,6 +89,8 @@ class DocumentChunk(db.Model):
     page_number = db.Column(db.Integer)
     content_preview = db.Column(db.Text)
     pinecone_id = db.Column(db.String(255))
+    content_hash = db.Column(db.String(64))  # SHA-256 of the chunk text
+    embedding = db.Column(db.LargeBinary)  # float32 vector, reused for identical chunks
     
     def __repr__(self):
         return f'<DocumentChunk {self.document_id}-{self.chunk_index}>'
@@ -66,6 +99,10 @@ class DocumentChunk(db.Model):
 class Conversation(db.Model):
     """Conversation model for storing chat history"""
     __tablename__ = 'conversations'
+    # Sidebar: a user's most recently updated conversations
+    __table_args__ = (
+        db.Index('ix_conversations_user_updated', 'user_id', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -81,6 +118,10 @@ class Conversation(db.Model):
 class Message(db.Model):
     """Message model for storing individual chat messages"""
     __tablename__ = 'messages'
+    # History pages, counts and previews are keyed on (created_at, id)
+    __table_args__ = (
+        db.Index('ix_messages_conversation_created', 'conversation_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
@@ -100,9 +141,9 @@ class Citation(db.Model):
     __tablename__ = 'citations'
     
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=False)
-    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=True)
-    chunk_id = db.Column(db.Integer, db.ForeignKey('document_chunks.id'), nullable=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=False, index=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=True, index=True)
+    chunk_id = db.Column(db.Integer, db.ForeignKey('document_chunks.id'), nullable=True, index=True)
     page_number = db.Column(db.Integer)
     relevance_score = db.Column(db.Float)
     content_snippet = db.Column(db.Text)
@@ -114,6 +155,10 @@ class Citation(db.Model):
 class Feedback(db.Model):
     """Feedback model for user ratings"""
     __tablename__ = 'feedbacks'
+    # Feedback is loaded per message and upserted per (message, user)
+    __table_args__ = (
+        db.Index('ix_feedbacks_message_user', 'message_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -125,3 +170,126 @@ class Feedback(db.Model):
     def __repr__(self):
         return f'<Feedback {self.id}>'
 
+
+# Key of the PostgreSQL advisory lock held while the schema is created or upgraded
+SCHEMA_LOCK_KEY = 720150016
+
+
+@contextmanager
+def schema_lock():
+    """
+    Serialise schema creation and upgrades between processes.
+
+    Every gunicorn worker initialises the database when it imports the app,
+    so on the first start after an upgrade they would otherwise run the same
+    DDL at once. PostgreSQL takes a session advisory lock; on other
+    databases the DDL in upgrade_schema() tolerates losing the race.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+    with db.engine.connect() as conn:
+        conn.execute(db.text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(db.text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            conn.commit()
+
+
+def add_missing_columns():
+    """
+    Add model columns that existing tables lack, as nullable columns.
+
+    Each column is added in its own transaction. When another process added
+    it first (SQLite has no ADD COLUMN IF NOT EXISTS), the error is ignored
+    and the column is left out of the result, so only one process runs the
+    follow-up backfill in upgrade_schema().
+
+    Returns:
+        Set of (table, column) names that were added
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = db.engine.dialect.identifier_preparer
+    added = set()
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                        f"{preparer.format_column(column)} {column.type.compile(dialect=db.engine.dialect)}"))
+            except DBAPIError:
+                current = {c['name'] for c in db.inspect(db.engine).get_columns(table.name)}
+                if column.name not in current:
+                    raise
+                continue
+            added.add((table.name, column.name))
+    return added
+
+
+def upgrade_schema():
+    """
+    Bring a database created by an older version up to the current models.
+
+    Run after db.create_all(); every step is idempotent.
+    """
+    added = add_missing_columns()
+    if ('documents', 'status') in added:
+        columns = {c['name'] for c in db.inspect(db.engine).get_columns('documents')}
+        with db.engine.begin() as conn:
+            if 'is_indexed' in columns:
+                # Uploads used to be indexed synchronously, so an unindexed row failed
+                conn.execute(db.text(
+                    "UPDATE documents SET status = CASE WHEN is_indexed THEN :indexed ELSE :failed END"),
+                    {"indexed": DocumentStatus.INDEXED, "failed": DocumentStatus.FAILED})
+            else:
+                conn.execute(db.text("UPDATE documents SET status = :indexed"),
+                             {"indexed": DocumentStatus.INDEXED})
+    create_missing_indexes()
+
+
+def create_missing_indexes():
+    """
+    Create model indexes that the connected database does not have yet.
+
+    db.create_all() only adds indexes together with a new table, so databases
+    created before an index was declared get it here. Safe to run on every
+    start, also by several processes at once: the check is part of the
+    statement (CREATE INDEX IF NOT EXISTS) rather than a separate query.
+    """
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def insert_document_chunks(document_id, chunk_rows):
+    """
+    Insert chunk rows for a document as one executemany and return their IDs.
+
+    On PostgreSQL SQLAlchemy sends this as a few batched INSERT ... RETURNING
+    statements. SQLite has no sentinel column to order RETURNING rows by, so
+    there SQLAlchemy falls back to one INSERT per row; the IDs are correct
+    either way.
+
+    Args:
+        document_id: Owning Document ID
+        chunk_rows: Dicts of DocumentChunk columns (without document_id)
+
+    Returns:
+        New chunk IDs, in the same order as `chunk_rows`
+    """
+    if not chunk_rows:
+        return []
+    stmt = db.insert(DocumentChunk).returning(
+        DocumentChunk.id, sort_by_parameter_order=True)
+    return db.session.scalars(
+        stmt, [dict(row, document_id=document_id) for row in chunk_rows]).all()
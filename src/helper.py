@@ -1,28 +1,58 @@
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from typing import List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional
 from langchain_core.documents import Document
+from src.cache import CachedEmbeddings
+from src.pdf_loader import iter_pdf_pages, load_pdf_pages, PDF_PARSE_PROCESSES
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import multiprocessing
+import glob
 import os
 
 
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 2048))
+EMBEDDING_CACHE_TTL = float(os.environ.get('EMBEDDING_CACHE_TTL', 3600))
+# Sentences per forward pass of the local model, and torch intra-op threads
+# (0 keeps torch's default of one thread per core)
+EMBED_ENCODE_BATCH_SIZE = int(os.environ.get('EMBED_ENCODE_BATCH_SIZE', 32))
+EMBED_TORCH_THREADS = int(os.environ.get('EMBED_TORCH_THREADS', 0))
+
+
 #Extract Data From the PDF File
-def load_pdf_file(data):
-    loader= DirectoryLoader(data,
-                            glob="*.pdf",
-                            loader_cls=PyPDFLoader)
+def iter_pdf_files(data, processes=PDF_PARSE_PROCESSES) -> Iterator[Document]:
+    """Stream the pages of every PDF in a directory, extracted on one shared process pool"""
+    file_paths = sorted(glob.glob(os.path.join(data, "*.pdf")))
+    if processes <= 1:
+        for file_path in file_paths:
+            yield from iter_pdf_pages(file_path, processes=1)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        for file_path in file_paths:
+            yield from iter_pdf_pages(file_path, executor=executor)
 
-    documents=loader.load()
 
-    return documents
+def load_pdf_file(data, processes=PDF_PARSE_PROCESSES):
+    """Load every PDF in a directory, extracting pages on one shared process pool"""
+    return list(iter_pdf_files(data, processes=processes))
 
 
-def load_single_pdf(file_path: str):
-    """Load a single PDF file"""
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
-    return documents
+def load_single_pdf(file_path: str, progress: Optional[Callable[[str, int], None]] = None,
+                    executor=None):
+    """Load a single PDF file, reporting `pages_total`/`pages_parsed` to `progress`"""
+    return load_pdf_pages(file_path, executor=executor, progress=progress)
+
+
+def iter_minimal_docs(docs: Iterable[Document]) -> Iterator[Document]:
+    """Streaming filter_to_minimal_docs"""
+    for doc in docs:
+        yield Document(
+            page_content=doc.page_content,
+            metadata={"source": doc.metadata.get("source"), "page": doc.metadata.get("page", 0)}
+        )
 
 
 def filter_to_minimal_docs(docs: List[Document]) -> List[Document]:
@@ -30,29 +60,63 @@ def filter_to_minimal_docs(docs: List[Document]) -> List[Document]:
     Given a list of Document objects, return a new list of Document objects
     containing only 'source' in metadata and the original page_content.
     """
-    minimal_docs: List[Document] = []
-    for doc in docs:
-        src = doc.metadata.get("source")
-        page = doc.metadata.get("page", 0)
-        minimal_docs.append(
-            Document(
-                page_content=doc.page_content,
-                metadata={"source": src, "page": page}
-            )
-        )
-    return minimal_docs
+    return list(iter_minimal_docs(docs))
 
 
 #Split the Data into Text Chunks
-def text_split(extracted_data, chunk_size=500, chunk_overlap=20):
+def text_split(extracted_data, chunk_size=500, chunk_overlap=20, progress=None):
+    return list(iter_text_chunks(extracted_data, chunk_size, chunk_overlap, progress=progress))
+
+
+def iter_text_chunks(documents: Iterable[Document], chunk_size=500, chunk_overlap=20,
+                     progress=None) -> Iterator[Document]:
+    """
+    Split documents one at a time, yielding chunks as they are produced.
+
+    Gives the same chunks as text_split (the splitter never joins text across
+    documents) while holding only one page in memory. `chunks_created` is
+    reported after each document.
+    """
     text_splitter=RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    text_chunks=text_splitter.split_documents(extracted_data)
-    return text_chunks
+    created = 0
+    for document in documents:
+        chunks = text_splitter.split_documents([document])
+        created += len(chunks)
+        if progress is not None:
+            progress("chunks_created", created)
+        yield from chunks
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield lists of up to `size` consecutive items"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def configure_torch_threads(num_threads=EMBED_TORCH_THREADS):
+    """Pin torch's intra-op thread pool used for CPU inference (0 = leave torch's default)"""
+    if not num_threads:
+        return
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        # Only allowed before the first parallel op; a single inter-op
+        # thread stops it competing with the intra-op pool
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
 
 
 #Download the Embeddings from HuggingFace 
-def download_hugging_face_embeddings():
-    embeddings=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')  #this model return 384 dimensions
+def download_hugging_face_embeddings(cache_size=EMBEDDING_CACHE_SIZE, cache_ttl=EMBEDDING_CACHE_TTL,
+                                     encode_batch_size=EMBED_ENCODE_BATCH_SIZE):
+    """Load the MiniLM model, wrapped in a shared query-embedding cache (cache_size=0 disables it)"""
+    configure_torch_threads()
+    embeddings=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2',  #this model return 384 dimensions
+                                     encode_kwargs={'batch_size': encode_batch_size})
+    if cache_size:
+        embeddings = CachedEmbeddings(embeddings, maxsize=cache_size, ttl=cache_ttl)
     return embeddings
 
 
@@ -0,0 +1,438 @@
+"""
+Background document ingestion: parse → split → embed → upsert outside the request
+"""
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import has_app_context
+from langchain_core.documents import Document as LCDocument
+from src.database import db, Document, DocumentChunk, DocumentStatus, insert_document_chunks
+from src.helper import iter_minimal_docs, iter_text_chunks, batched
+from src.pdf_loader import iter_pdf_pages
+from src.vector_store import embed_and_upsert_batches, document_vector_ids, delete_ids, EMBED_BATCH_SIZE
+from typing import Callable, Dict, Iterator, List, Optional
+from datetime import datetime, timedelta
+from array import array
+import multiprocessing
+import hashlib
+import threading
+import traceback
+import time
+import os
+
+
+# Minimum seconds between progress writes to Document.progress
+PROGRESS_SAVE_INTERVAL = 1.0
+# Seconds without a status or progress write after which a pending or
+# processing document is considered abandoned by its (restarted) process
+INGEST_STALE_AFTER = int(os.environ.get('INGEST_STALE_AFTER', 900))
+INTERRUPTED_ERROR = "Indexing was interrupted by a server restart. Please upload the file again."
+
+
+class IngestionProgress:
+    """
+    Live counters for one document's ingestion.
+
+    Instances are callables with the `progress(counter, value)` signature the
+    loaders in src.pdf_loader and src.helper report through, so they can be handed straight to
+    iter_pdf_pages and iter_text_chunks.
+    """
+
+    COUNTERS = ("pages_total", "pages_parsed", "chunks_created",
+                "chunks_embedded", "vectors_upserted")
+
+    def __init__(self, document_id: int):
+        self.document_id = document_id
+        self.stage = "queued"
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.save: Callable[[], None] = lambda: None
+        self._lock = threading.Lock()
+
+    def __call__(self, counter: str, value: int):
+        with self._lock:
+            self.counters[counter] = value
+
+    def set_stage(self, stage: str):
+        with self._lock:
+            self.stage = stage
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"stage": self.stage, **self.counters}
+
+
+# Progress of the documents being ingested by this process
+_active: Dict[int, IngestionProgress] = {}
+_active_lock = threading.Lock()
+
+
+def get_progress(document_id: int) -> Optional[dict]:
+    """Live counters of a document ingested by this process, or None"""
+    with _active_lock:
+        progress = _active.get(document_id)
+    return progress.snapshot() if progress is not None else None
+
+
+def load_document_chunks(file_path: str, progress: Optional[Callable] = None,
+                         executor=None) -> Iterator[LCDocument]:
+    """Stream a PDF's text chunks, parsing page ranges on `executor` when given"""
+    pages = iter_pdf_pages(file_path, executor=executor, progress=progress)
+    return iter_text_chunks(iter_minimal_docs(pages), progress=progress)
+
+
+def file_sha256(stream, block_size: int = 1 << 20) -> str:
+    """Hex SHA-256 of a file-like object's contents; the stream is rewound afterwards"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def pack_embedding(vector) -> bytes:
+    return array('f', vector).tobytes()
+
+
+def unpack_embedding(blob: bytes) -> List[float]:
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+def stored_embeddings(hashes) -> Dict[str, List[float]]:
+    """Embeddings of already indexed chunks with these text hashes, one row per hash"""
+    if not hashes:
+        return {}
+    first_rows = db.select(db.func.min(DocumentChunk.id))\
+        .where(DocumentChunk.content_hash.in_(set(hashes)), DocumentChunk.embedding.isnot(None))\
+        .group_by(DocumentChunk.content_hash)
+    rows = db.session.query(DocumentChunk.content_hash, DocumentChunk.embedding)\
+        .filter(DocumentChunk.id.in_(first_rows)).all()
+    return {content_hash: unpack_embedding(blob) for content_hash, blob in rows}
+
+
+def chunk_metadata(chunk: LCDocument, document: Document, chunk_id: int) -> dict:
+    """Vector-store metadata for a chunk: scalar values plus document/chunk/user IDs"""
+    clean_metadata = {}
+
+    original_source = chunk.metadata.get('source', document.file_path)
+    clean_metadata['source'] = str(
+        original_source) if original_source else str(document.file_path)
+
+    for key, value in chunk.metadata.items():
+        if key == 'source':
+            continue
+        if value is not None:
+            if isinstance(value, (str, int, float, bool)):
+                clean_metadata[key] = value
+            elif isinstance(value, list):
+                clean_metadata[key] = [str(v)
+                                       for v in value if v is not None]
+
+    clean_metadata['document_id'] = str(document.id)
+    clean_metadata['chunk_id'] = str(chunk_id)
+    clean_metadata['user_id'] = str(document.user_id)
+
+    page = clean_metadata.get('page', chunk.metadata.get('page', 0))
+    clean_metadata['page'] = int(page) if isinstance(
+        page, (int, float)) else 0
+    return clean_metadata
+
+
+def delete_document_vectors(vector_store, document: Document):
+    """
+    Delete a document's vectors by the IDs recorded on its chunks.
+
+    Documents indexed before chunk vector IDs were recorded fall back to a
+    document_id metadata filter.
+    """
+    vector_ids = [chunk.pinecone_id for chunk in document.chunks]
+    if vector_ids and all(vector_ids):
+        delete_ids(vector_store, vector_ids)
+    else:
+        vector_store.delete(filter={"document_id": str(document.id)})
+
+
+def stale_ingestion(now: Optional[datetime] = None):
+    """SQL condition for in-flight documents not written to for INGEST_STALE_AFTER seconds"""
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=INGEST_STALE_AFTER)
+    return db.and_(Document.status.in_((DocumentStatus.PENDING, DocumentStatus.PROCESSING)),
+                   db.func.coalesce(Document.updated_at, Document.uploaded_at) < cutoff)
+
+
+def is_stale(document, now: Optional[datetime] = None) -> bool:
+    """stale_ingestion() for an already loaded Document (or row with its columns)"""
+    if document.status not in (DocumentStatus.PENDING, DocumentStatus.PROCESSING):
+        return False
+    last_write = document.updated_at or document.uploaded_at
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=INGEST_STALE_AFTER)
+    return last_write is not None and last_write < cutoff
+
+
+def fail_stale_documents(vector_store, document_ids: Optional[List[int]] = None) -> List[int]:
+    """
+    Mark documents whose ingestion job was lost as FAILED and drop their partial chunks.
+
+    Jobs live only in the memory of the process that accepted the upload, so
+    nothing resumes them after a restart or a killed worker. Each row is
+    claimed with a conditional UPDATE, so when several workers find the same
+    row exactly one of them cleans it up.
+
+    Args:
+        vector_store: Store the partial vectors are deleted from (None skips that)
+        document_ids: Only consider these documents (default: all)
+
+    Returns:
+        IDs of the documents marked FAILED
+    """
+    failed = []
+    query = db.select(Document.id).where(stale_ingestion())
+    if document_ids is not None:
+        query = query.where(Document.id.in_(document_ids))
+    for document_id in db.session.scalars(query).all():
+        claimed = db.session.execute(
+            db.update(Document).where(Document.id == document_id, stale_ingestion())
+            .values(status=DocumentStatus.FAILED, error=INTERRUPTED_ERROR)).rowcount
+        db.session.commit()
+        if not claimed:
+            continue
+        if vector_store is not None:
+            try:
+                delete_document_vectors(vector_store, db.session.get(Document, document_id))
+            except Exception as e:
+                print(f"Warning: Could not delete partial vectors for document {document_id}: {e}")
+        DocumentChunk.query.filter_by(document_id=document_id).delete()
+        db.session.commit()
+        failed.append(document_id)
+    if failed:
+        print(f"Marked {len(failed)} interrupted uploads as failed: {failed}")
+    return failed
+
+
+def fail_if_stale(vector_store, document) -> bool:
+    """
+    Fail `document` if its ingestion job was lost, whenever that happened.
+
+    A worker killed mid-job restarts before the job goes stale, so its
+    startup sweep misses it; readers of a document's status call this
+    instead. It only queries when the loaded row already looks stale and
+    no job for it runs in this process.
+
+    Returns:
+        True when this call marked the document FAILED
+    """
+    if not is_stale(document) or get_progress(document.id) is not None:
+        return False
+    return bool(fail_stale_documents(vector_store, [document.id]))
+
+
+def ingest_document(document_id: int, vector_store, load_chunks: Optional[Callable] = None,
+                    on_indexed: Optional[Callable[[Document], None]] = None,
+                    progress: Optional[IngestionProgress] = None):
+    """
+    Index an uploaded Document and record the outcome in its status.
+
+    Chunks stream from the parser through chunk-row inserts, embedding and
+    upserts in batches of EMBED_BATCH_SIZE, so memory depends on the batch
+    size rather than the document size. Progress counters are kept in memory
+    for get_progress() and written to Document.progress at most every
+    PROGRESS_SAVE_INTERVAL seconds, so other processes can follow along too.
+    Each chunk's vector ID comes from document_vector_ids and is recorded in
+    DocumentChunk.pinecone_id, so re-sent upserts overwrite rather than
+    duplicate and a failed job deletes exactly the vectors it sent.
+
+    Args:
+        document_id: Document to index (status PENDING)
+        vector_store: Store the chunk vectors are added to
+        load_chunks: Callable(file_path, progress) returning an iterable of text chunks
+        on_indexed: Called with the Document once it is INDEXED
+        progress: Counters to update (default: a fresh IngestionProgress)
+    """
+    doc = db.session.get(Document, document_id)
+    if doc is None:
+        return
+    progress = progress or IngestionProgress(document_id)
+    load_chunks = load_chunks or load_document_chunks
+    user_id, file_path = doc.user_id, doc.file_path
+    saved_at = [0.0]
+
+    def save(force=True):
+        if not force and time.monotonic() - saved_at[0] < PROGRESS_SAVE_INTERVAL:
+            return
+        doc.progress = progress.snapshot()
+        db.session.commit()
+        saved_at[0] = time.monotonic()
+
+    progress.save = lambda: save(force=False)
+    # Chunks handed to the upserter so far; their vector IDs are
+    # document_vector_ids(document_id, 0, sent)
+    sent = 0
+    with _active_lock:
+        _active[document_id] = progress
+
+    try:
+        progress.set_stage("parsing")
+        # Claimed atomically: a row another process already took, or that
+        # fail_stale_documents gave up on, is left alone
+        claimed = db.session.execute(
+            db.update(Document).where(Document.id == document_id,
+                                      Document.status == DocumentStatus.PENDING)
+            .values(status=DocumentStatus.PROCESSING)).rowcount
+        db.session.commit()
+        if not claimed:
+            print(f"Document {document_id} is no longer pending, not indexing it")
+            return
+        save()
+
+        reused = 0
+
+        def chunk_batches():
+            nonlocal reused, sent
+            for batch in batched(load_chunks(file_path, progress), EMBED_BATCH_SIZE):
+                progress.set_stage("indexing")
+                texts = [chunk.page_content for chunk in batch]
+                hashes = [text_sha256(text) for text in texts]
+
+                # Identical chunks (from any user's documents, or repeated in
+                # this one) reuse their stored embedding instead of the model
+                vectors = stored_embeddings(hashes)
+                missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+                if missing:
+                    vectors.update(zip(missing, vector_store.embeddings.embed_documents(list(missing.values()))))
+                reused += len(batch) - len(missing)
+
+                vector_ids = document_vector_ids(document_id, sent, sent + len(batch))
+                chunk_ids = insert_document_chunks(doc.id, [{
+                    'chunk_index': sent + i,
+                    'page_number': chunk.metadata.get('page', 0),
+                    'content_preview': chunk.page_content[:200],
+                    'content_hash': h,
+                    'embedding': pack_embedding(vectors[h]),
+                    'pinecone_id': vector_id
+                } for i, (chunk, h, vector_id) in enumerate(zip(batch, hashes, vector_ids))])
+                sent += len(batch)
+                yield (texts,
+                       [chunk_metadata(chunk, doc, chunk_id) for chunk, chunk_id in zip(batch, chunk_ids)],
+                       vector_ids,
+                       [vectors[h] for h in hashes])
+
+        def report(counter, value):
+            progress(counter, value)
+            # Embedding runs on this thread, which owns the session
+            if counter == "chunks_embedded":
+                save(force=False)
+
+        print(f"Indexing document {document_id} for user {user_id}")
+        stats = embed_and_upsert_batches(vector_store, chunk_batches(), progress=report)
+        if not stats["chunks"]:
+            progress.set_stage("failed")
+            doc.status = DocumentStatus.FAILED
+            doc.error = "PDF appears to be empty or could not be processed. Please check the file."
+            save()
+            return
+        print(f"Document {document_id}: parsed, embedded and upserted {stats['chunks']} chunks "
+              f"({reused} reused embeddings) in {stats['seconds']:.1f}s "
+              f"({stats['chunks_per_sec']:.1f} chunks/s)")
+
+        progress.set_stage("done")
+        doc.status = DocumentStatus.INDEXED
+        save()
+        print(f"Document {document_id} indexed")
+    except Exception as e:
+        print(f"Ingestion error for document {document_id}: {e}")
+        print(traceback.format_exc())
+        db.session.rollback()
+        try:
+            # Chunk rows may be rolled back, but the IDs sent are known exactly
+            delete_ids(vector_store, document_vector_ids(document_id, 0, sent))
+        except Exception as cleanup_error:
+            print(f"Warning: Could not delete partial vectors for document {document_id}: {cleanup_error}")
+        doc = db.session.get(Document, document_id)
+        if doc is None:
+            return
+        DocumentChunk.query.filter_by(document_id=document_id).delete()
+        progress.set_stage("failed")
+        doc.status = DocumentStatus.FAILED
+        doc.error = str(e)
+        save()
+        return
+    finally:
+        with _active_lock:
+            _active.pop(document_id, None)
+
+    # The document may have been deleted while it was being indexed
+    if db.session.get(Document, document_id) is None:
+        delete_ids(vector_store, document_vector_ids(document_id, 0, stats["chunks"]))
+    elif on_indexed is not None:
+        on_indexed(doc)
+
+
+class IngestionQueue:
+    """
+    Runs ingest_document jobs on background threads.
+
+    Each job runs in the Flask application context of `app` (inline jobs reuse
+    the caller's). PDF text extraction, the CPU-heavy part, is split into page
+    ranges that run on a shared pool of `parse_processes` processes, so it
+    neither holds the web process's GIL nor serialises concurrent uploads, and
+    one large PDF uses every parse process. Job state lives in
+    Document.status, so the queue itself only holds document IDs.
+
+    Args:
+        app: Flask app whose context wraps each job
+        workers: Concurrent ingestion jobs (0 = run jobs inline in submit)
+        parse_processes: Parse processes (0 = per-upload pools, see PDF_PARSE_PROCESSES)
+    """
+
+    def __init__(self, app, workers: int = 2, parse_processes: int = 2):
+        self.app = app
+        self.workers = workers
+        self.parse_processes = parse_processes
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ingest') if workers else None
+        self._parse_pool = None
+        self._lock = threading.Lock()
+
+    def submit(self, document_id: int, vector_store, on_indexed=None):
+        """Queue a document for indexing"""
+        progress = IngestionProgress(document_id)
+        with _active_lock:
+            _active[document_id] = progress
+        if self._executor is None:
+            return self._run(document_id, vector_store, on_indexed, progress)
+        return self._executor.submit(self._run, document_id, vector_store, on_indexed, progress)
+
+    def load_chunks(self, file_path: str, progress: IngestionProgress) -> Iterator[LCDocument]:
+        def report(counter, value):
+            progress(counter, value)
+            progress.save()
+
+        if not self.parse_processes:
+            yield from load_document_chunks(file_path, progress=report)
+            return
+        pool = self._get_parse_pool()
+        try:
+            yield from load_document_chunks(file_path, progress=report, executor=pool)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._parse_pool is pool:
+                    self._parse_pool = None
+            raise
+
+    def _get_parse_pool(self):
+        with self._lock:
+            if self._parse_pool is None:
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_processes,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._parse_pool
+
+    def _run(self, document_id, vector_store, on_indexed, progress):
+        kwargs = dict(load_chunks=self.load_chunks, on_indexed=on_indexed, progress=progress)
+        if has_app_context():
+            return ingest_document(document_id, vector_store, **kwargs)
+        with self.app.app_context():
+            return ingest_document(document_id, vector_store, **kwargs)
@@ -0,0 +1,133 @@
+"""
+Parallel PDF text extraction: page ranges are extracted concurrently by a process pool
+
+Kept free of heavy imports so spawned worker processes start quickly.
+"""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from langchain_core.documents import Document
+from typing import Callable, Iterator, List, Optional, Tuple
+import multiprocessing
+import os
+
+
+# Processes used to extract one PDF's pages (1 = extract serially)
+PDF_PARSE_PROCESSES = int(os.environ.get('PDF_PARSE_PROCESSES', os.cpu_count() or 1))
+# Smaller PDFs are extracted serially; starting workers would cost more than it saves
+PDF_PARALLEL_MIN_PAGES = 32
+# Page-range tasks per worker, so uneven pages still balance across processes
+TASKS_PER_PROCESS = 4
+# Upper bound on a task's pages, which bounds the text held in flight
+MAX_PAGES_PER_TASK = 16
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract the text of pages [start, end) as (page_index, text) pairs"""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text()) for i in range(start, end)]
+
+
+def pdf_metadata(reader, file_path: str) -> dict:
+    """
+    Document-level metadata the way PyPDFLoader reports it: the PDF info
+    dictionary with lower-cased keys and ISO dates (`producer`, `creator`,
+    `creationdate`, ...), plus `source` and `total_pages`.
+    """
+    info = {"producer": "PyPDF", "creator": "PyPDF", "creationdate": "",
+            **(reader.metadata or {}), "source": file_path, "total_pages": len(reader.pages)}
+    metadata = {}
+    for key, value in info.items():
+        if type(value) not in (str, int):
+            value = str(value)
+        key = key.lstrip("/").lower()
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(value, str):
+            value = value.strip()
+        metadata[key] = value
+    return metadata
+
+
+def page_ranges(total_pages: int, tasks: int) -> List[Tuple[int, int]]:
+    """Split [0, total_pages) into at most `tasks` contiguous, near-equal ranges"""
+    size = max(1, -(-total_pages // max(1, tasks)))
+    return [(start, min(start + size, total_pages)) for start in range(0, total_pages, size)]
+
+
+def iter_pdf_pages(file_path: str, executor: Optional[Executor] = None,
+                   processes: int = PDF_PARSE_PROCESSES,
+                   progress: Optional[Callable[[str, int], None]] = None) -> Iterator[Document]:
+    """
+    Extract a PDF into one Document per page, yielded in page order.
+
+    Page ranges are extracted on `executor` when given; otherwise PDFs of at
+    least PDF_PARALLEL_MIN_PAGES pages get a temporary pool of `processes`
+    processes and smaller ones are read serially. Every path yields the same
+    Documents as PyPDFLoader: the stripped page text with pdf_metadata()
+    plus `page` (0-based) and `page_label`. At most two ranges per worker
+    (of at most MAX_PAGES_PER_TASK pages) are in flight, so memory does not
+    grow with the page count.
+
+    Args:
+        file_path: PDF to read
+        executor: Pool to run page-range extraction on (shared across PDFs)
+        processes: Pool size when no executor is given
+        progress: Called with ("pages_total", n) and ("pages_parsed", n)
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    report = progress or (lambda counter, value: None)
+    report("pages_total", total_pages)
+    metadata, page_labels = pdf_metadata(reader, file_path), reader.page_labels
+
+    def page_document(i, text):
+        return Document(page_content=text.strip(),
+                        metadata={**metadata, "page": i, "page_label": page_labels[i]})
+
+    if executor is None and (processes <= 1 or total_pages < PDF_PARALLEL_MIN_PAGES):
+        for i, page in enumerate(reader.pages):
+            text = page.extract_text()
+            report("pages_parsed", i + 1)
+            yield page_document(i, text)
+        return
+    del reader
+
+    owned = executor is None
+    if owned:
+        executor = ProcessPoolExecutor(max_workers=processes,
+                                       mp_context=multiprocessing.get_context('spawn'))
+    workers = getattr(executor, '_max_workers', processes)
+    tasks = max(workers * TASKS_PER_PROCESS, -(-total_pages // MAX_PAGES_PER_TASK))
+    ranges = iter(page_ranges(total_pages, tasks))
+    in_flight = deque()
+    try:
+        for start, end in islice(ranges, workers * 2):
+            in_flight.append(executor.submit(extract_page_range, file_path, start, end))
+        parsed = 0
+        while in_flight:
+            pages = in_flight.popleft().result()
+            for start, end in islice(ranges, 1):
+                in_flight.append(executor.submit(extract_page_range, file_path, start, end))
+            parsed += len(pages)
+            report("pages_parsed", parsed)
+            for i, text in pages:
+                yield page_document(i, text)
+    finally:
+        for future in in_flight:
+            future.cancel()
+        if owned:
+            executor.shutdown(cancel_futures=True)
+
+
+def load_pdf_pages(file_path: str, executor: Optional[Executor] = None,
+                   processes: int = PDF_PARSE_PROCESSES,
+                   progress: Optional[Callable[[str, int], None]] = None) -> List[Document]:
+    """All pages of a PDF as a list, see iter_pdf_pages"""
+    return list(iter_pdf_pages(file_path, executor=executor, processes=processes, progress=progress))
@@ -0,0 +1,85 @@
+"""
+Write-behind persistence: database writes that must not delay a response
+"""
+from typing import Any, Callable, Optional
+from flask import has_app_context
+import atexit
+import queue
+import threading
+import traceback
+
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of write jobs executed by background worker threads.
+
+    Jobs run inside the Flask application context of `app` (when given), so
+    they can use `db.session` like a request would; inline jobs reuse the
+    caller's context. The queue never drops a write: when it is full, `submit`
+    runs the job in the caller's thread, and with `workers=0` every job runs
+    inline. Pending jobs are drained on interpreter shutdown.
+
+    Args:
+        app: Flask app whose context wraps each job (None = no context)
+        maxsize: Maximum number of queued jobs before falling back to inline
+        workers: Number of worker threads (0 = synchronous)
+    """
+
+    def __init__(self, app=None, maxsize: int = 256, workers: int = 1):
+        self.app = app
+        self.workers = workers
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._threads = [
+            threading.Thread(target=self._run, name=f'write-behind-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if self._threads:
+            atexit.register(self.close)
+
+    def submit(self, job: Callable[..., Any], *args, **kwargs):
+        """Queue `job(*args, **kwargs)`; runs it inline if no worker can take it"""
+        if self._threads:
+            try:
+                self._queue.put_nowait((job, args, kwargs))
+                return
+            except queue.Full:
+                print("Write-behind queue full, persisting inline")
+        self._execute(job, args, kwargs)
+
+    def flush(self):
+        """Block until every queued job has finished"""
+        self._queue.join()
+
+    def close(self, timeout: Optional[float] = 30):
+        """Finish queued jobs and stop the workers"""
+        for _ in self._threads:
+            self._queue.put((_STOP, (), {}))
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while True:
+            job, args, kwargs = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._execute(job, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job, args, kwargs):
+        try:
+            if self.app is None or has_app_context():
+                job(*args, **kwargs)
+            else:
+                with self.app.app_context():
+                    job(*args, **kwargs)
+        except Exception as e:
+            print(f"Write-behind job {getattr(job, '__name__', job)} failed: {e}")
+            print(traceback.format_exc())
@@ -3,8 +3,38 @@ Advanced RAG features: Query rewriting and multi-hop reasoning
 """
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.cache import LRUCache, normalize_query
+from src.retrieval import invoke_retriever
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 import json
+import os
+import re
+import time
+
+
+# "always": rewrite every query; "cached": skip specific queries and reuse
+# earlier rewrites; "race": like "cached", but retrieve with the original
+# query while the rewrite is in flight, and use the rewrite only if it is
+# ready by then (a late one just fills the cache); "off": never rewrite
+QUERY_REWRITE_MODE = os.environ.get('QUERY_REWRITE_MODE', 'cached')
+REWRITE_MIN_WORDS = int(os.environ.get('REWRITE_MIN_WORDS', 6))
+
+_rewrite_cache = LRUCache(
+    maxsize=int(os.environ.get('REWRITE_CACHE_SIZE', 2048)),
+    ttl=float(os.environ.get('REWRITE_CACHE_TTL', 86400)))
+_rewrite_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rewrite')
+
+# Sub-question retrievals get their own pool: the retriever passed in may
+# itself fan out on the shared retrieval pool, and nesting both on one
+# bounded pool could deadlock under load.
+MULTI_HOP_MAX_WORKERS = int(os.environ.get('MULTI_HOP_MAX_WORKERS', 4))
+_hop_executor = ThreadPoolExecutor(
+    max_workers=MULTI_HOP_MAX_WORKERS, thread_name_prefix='multi-hop')
+
+# Words that point back at earlier context; queries using them need rewriting
+_VAGUE_TERMS = {"it", "its", "this", "that", "these", "those", "they", "them",
+                "thing", "things", "stuff", "same", "above"}
 
 
 def create_query_rewriter_prompt():
@@ -23,12 +53,99 @@ Return ONLY the rewritten query, nothing else."""),
     ])
 
 
-def rewrite_query(llm, original_query: str) -> str:
+def rewrite_query(llm, original_query: str, use_cache: bool = True) -> str:
     """Rewrite user query for better retrieval"""
+    if use_cache:
+        cached = get_cached_rewrite(original_query)
+        if cached is not None:
+            return cached
     prompt = create_query_rewriter_prompt()
     chain = prompt | llm | StrOutputParser()
-    rewritten = chain.invoke({"original_query": original_query})
-    return rewritten.strip()
+    rewritten = chain.invoke({"original_query": original_query}).strip()
+    _rewrite_cache.set(("exact", original_query), rewritten)
+    _rewrite_cache.set(("normalized", normalize_query(original_query)), rewritten)
+    return rewritten
+
+
+def get_cached_rewrite(original_query: str) -> Optional[str]:
+    """Look up an earlier rewrite by exact text, then by normalized text"""
+    cached = _rewrite_cache.get(("exact", original_query))
+    if cached is None:
+        cached = _rewrite_cache.get(("normalized", normalize_query(original_query)))
+    return cached
+
+
+def is_specific_query(query: str, min_words: int = REWRITE_MIN_WORDS) -> bool:
+    """Heuristic: long enough and free of vague references, so rewriting adds little"""
+    words = re.findall(r"[a-z0-9']+", query.lower())
+    return len(words) >= min_words and not any(w in _VAGUE_TERMS for w in words)
+
+
+def retrieve_with_rewrite(llm, retriever, original_query: str, mode: str = None,
+                          timings: Optional[Dict[str, Any]] = None) -> Tuple[list, str]:
+    """
+    Retrieve documents for a query, rewriting it first according to `mode`
+
+    Args:
+        llm: Language model instance
+        retriever: Document retriever or callable
+        original_query: Original user query
+        mode: "always", "cached", "race" or "off" (default: QUERY_REWRITE_MODE)
+        timings: Optional dict filled with "rewrite" (how the query was chosen),
+            "rewrite_ms" (time the LLM rewrite of the query used took, 0 if none)
+            and "retrieval_ms" (time to retrieve with the query used)
+
+    Returns:
+        (documents, query used for retrieval)
+    """
+    mode = mode or QUERY_REWRITE_MODE
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+
+    query, source = None, None
+    if mode == "off":
+        query, source = original_query, "off"
+    elif mode != "always":
+        if is_specific_query(original_query):
+            query, source = original_query, "bypass"
+        else:
+            query = get_cached_rewrite(original_query)
+            source = "cache" if query is not None else None
+
+    if query is None and mode == "race":
+        def timed_rewrite():
+            rewrite_start = time.perf_counter()
+            rewritten = rewrite_query(llm, original_query, use_cache=False)
+            return rewritten, time.perf_counter() - rewrite_start
+
+        # Only the LLM call goes to the pool; the original query is retrieved
+        # on this thread so it never queues behind other requests' rewrites
+        rewrite_future = _rewrite_executor.submit(timed_rewrite)
+        docs = invoke_retriever(retriever, original_query)
+        retrieved = time.perf_counter()
+        if rewrite_future.done() and rewrite_future.exception() is None:
+            query, rewrite_seconds = rewrite_future.result()
+            if query != original_query:
+                docs = invoke_retriever(retriever, query)
+            timings["rewrite"] = "race-rewritten"
+            timings["rewrite_ms"] = round(rewrite_seconds * 1000, 1)
+            timings["retrieval_ms"] = round((time.perf_counter() - retrieved) * 1000, 1)
+            return docs, query
+        timings["rewrite"] = "race-original"
+        timings["rewrite_ms"] = 0.0
+        timings["retrieval_ms"] = round((retrieved - start) * 1000, 1)
+        return docs, original_query
+
+    if query is None:
+        query = rewrite_query(llm, original_query, use_cache=(mode != "always"))
+        source = "llm"
+    rewrite_done = time.perf_counter()
+
+    docs = invoke_retriever(retriever, query)
+    timings["rewrite"] = source
+    timings["rewrite_ms"] = round((rewrite_done - start) * 1000, 1)
+    timings["retrieval_ms"] = round((time.perf_counter() - rewrite_done) * 1000, 1)
+    return docs, query
 
 
 def create_multi_hop_prompt():
@@ -78,48 +195,58 @@ def analyze_query_complexity(llm, question: str, context: str) -> Dict[str, Any]
         }
 
 
-def multi_hop_reasoning(llm, retriever, original_query: str, max_hops: int = 2) -> Dict[str, Any]:
+def _status(stage: str, message: str) -> Dict[str, Any]:
+    return {"type": "status", "stage": stage, "message": message}
+
+
+def multi_hop_reasoning_stream(llm, retriever, original_query: str,
+                               max_hops: int = 2) -> Iterator[Dict[str, Any]]:
     """
-    Perform multi-hop reasoning by breaking down complex queries
-    
-    Args:
-        llm: Language model instance
-        retriever: Document retriever
-        original_query: Original user query
-        max_hops: Maximum number of reasoning hops
+    Multi-hop reasoning as a stream of progress events
     
-    Returns:
-        Dictionary with final answer and reasoning chain
+    Yields dicts with a "type" key:
+        status: {"stage", "message"} before each step, and as each hop returns
+        token: {"content"} pieces of the final answer as they are generated
+        result: {"answer", "reasoning_chain", "context_used"} once at the end
     """
-    def _retrieve(query):
-        if hasattr(retriever, "invoke"):
-            return retriever.invoke(query)
-        return retriever(query)
-
+    yield _status("rewriting", "Rewriting question")
     rewritten_query = rewrite_query(llm, original_query)
     
-    initial_docs = _retrieve(rewritten_query)
+    yield _status("retrieving", "Retrieving documents")
+    initial_docs = invoke_retriever(retriever, rewritten_query)
     initial_context = "\n\n".join([doc.page_content for doc in initial_docs])
     
+    yield _status("analyzing", "Analyzing question")
     analysis = analyze_query_complexity(llm, rewritten_query, initial_context)
     
     if analysis["type"] == "direct":
-        return {
+        yield {"type": "token", "content": analysis["answer"]}
+        yield {
+            "type": "result",
             "answer": analysis["answer"],
             "reasoning_chain": [rewritten_query],
             "context_used": initial_docs
         }
+        return
     
-    reasoning_chain = [rewritten_query]
+    sub_questions = analysis["sub_questions"][:max_hops]
+    reasoning_chain = [rewritten_query] + sub_questions
     all_contexts = list(initial_docs)
     
-    for i, sub_question in enumerate(analysis["sub_questions"][:max_hops]):
-        sub_docs = _retrieve(sub_question)
+    # Hops are independent lookups, so fetch them concurrently and report
+    # each as it lands; contexts are merged in sub-question order
+    yield _status("retrieving_hops", f"Retrieving {len(sub_questions)} sub-questions")
+    futures = {
+        _hop_executor.submit(invoke_retriever, retriever, q): i
+        for i, q in enumerate(sub_questions)
+    }
+    hop_docs = [None] * len(sub_questions)
+    for n, future in enumerate(as_completed(futures), 1):
+        hop_docs[futures[future]] = future.result()
+        yield _status("retrieving_hops",
+                      f"Retrieved hop {futures[future] + 1} ({n}/{len(sub_questions)})")
+    for sub_docs in hop_docs:
         all_contexts.extend(sub_docs)
-        reasoning_chain.append(sub_question)
-        
-        if i >= max_hops - 1:
-            break
     
     combined_context = "\n\n".join([doc.page_content for doc in all_contexts])
     
@@ -130,16 +257,38 @@ Use all the provided context to give a complete, accurate answer. Cite which par
         ("human", "Original Question: {original_query}\n\nSub-questions explored:\n{sub_questions}\n\nCombined Context:\n{context}\n\nComprehensive Answer:")
     ])
     
+    yield _status("synthesizing", "Writing answer")
     chain = synthesis_prompt | llm | StrOutputParser()
-    final_answer = chain.invoke({
+    final_answer = ""
+    for token in chain.stream({
         "original_query": original_query,
         "sub_questions": "\n".join([f"- {q}" for q in reasoning_chain[1:]]),
         "context": combined_context
-    })
+    }):
+        final_answer += token
+        yield {"type": "token", "content": token}
     
-    return {
+    yield {
+        "type": "result",
         "answer": final_answer,
         "reasoning_chain": reasoning_chain,
         "context_used": all_contexts
     }
 
+
+def multi_hop_reasoning(llm, retriever, original_query: str, max_hops: int = 2) -> Dict[str, Any]:
+    """
+    Perform multi-hop reasoning by breaking down complex queries
+    
+    Args:
+        llm: Language model instance
+        retriever: Document retriever
+        original_query: Original user query
+        max_hops: Maximum number of reasoning hops
+    
+    Returns:
+        Dictionary with final answer and reasoning chain
+    """
+    for event in multi_hop_reasoning_stream(llm, retriever, original_query, max_hops):
+        if event["type"] == "result":
+            return {k: v for k, v in event.items() if k != "type"}
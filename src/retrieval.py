@@ -0,0 +1,48 @@
+"""
+Retrieval helpers: concurrent fan-out of a query over several retrievers
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any
+import os
+
+
+RETRIEVAL_MAX_WORKERS = int(os.environ.get('RETRIEVAL_MAX_WORKERS', 8))
+
+# Shared, bounded pool so concurrent chat requests cannot spawn unbounded
+# threads against the vector store.
+_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix='retrieval')
+
+
+def invoke_retriever(retriever, query: str):
+    """Run a query against a retriever object or a plain callable"""
+    if hasattr(retriever, "invoke"):
+        return retriever.invoke(query)
+    return retriever(query)
+
+
+def parallel_retrieve(retrievers: List[Any], query: str) -> List[list]:
+    """
+    Send the same query to every retriever at once.
+
+    Args:
+        retrievers: Retrievers (or callables); None entries yield an empty result
+        query: Query text
+
+    Returns:
+        One result list per retriever, in the same order as `retrievers`
+    """
+    active = [r for r in retrievers if r is not None]
+    if len(active) <= 1:
+        return [invoke_retriever(r, query) if r is not None else [] for r in retrievers]
+
+    futures = [
+        _executor.submit(invoke_retriever, r, query) if r is not None else None
+        for r in retrievers
+    ]
+    return [f.result() if f is not None else [] for f in futures]
+
+
+def user_scope_filter(user_id) -> dict:
+    """Metadata filter matching a user's own chunks plus the global corpus"""
+    return {"user_id": {"$in": [str(user_id), "global"]}}
@@ -0,0 +1,834 @@
+"""
+Vector store backends: hosted Pinecone or a local on-disk NumPy index.
+
+The local backend keeps L2-normalised float32 vectors in a raw, memory-mapped
+file and an append-only JSONL log of records and deletions next to it, so it
+can serve retrieval without a network hop and run fully offline.
+"""
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from collections import defaultdict
+from src.ann_index import HNSWIndex
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Iterable, Dict, Any, Tuple
+import numpy as np
+import threading
+import weakref
+import pickle
+import atexit
+import json
+import uuid
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+VECTOR_STORE_BACKEND = os.environ.get('VECTOR_STORE_BACKEND', 'pinecone')
+LOCAL_INDEX_DIR = os.environ.get('LOCAL_INDEX_DIR', 'data/vector_index')
+LOCAL_INDEX_TYPE = os.environ.get('LOCAL_INDEX_TYPE', 'exact')
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 8))
+# Rows inserted into the HNSW graph between saves of hnsw.pkl. Graph inserts
+# happen in the process that appended the rows; other processes search rows
+# missing from the newest saved graph exactly. flush() saves the rest
+HNSW_SAVE_EVERY = int(os.environ.get('HNSW_SAVE_EVERY', 1000))
+# Chunks embedded per model call, and vectors per upsert request, at ingestion
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 64))
+UPSERT_BATCH_SIZE = int(os.environ.get('UPSERT_BATCH_SIZE', 100))
+# Attempts per upsert request before ingestion gives up
+UPSERT_RETRIES = int(os.environ.get('UPSERT_RETRIES', 3))
+# Pinecone accepts at most 1000 IDs per delete request
+DELETE_BATCH_SIZE = 1000
+IVF_MIN_TRAIN = 1024
+# Filtered searches with at most this many candidate rows are scanned exactly
+EXACT_SEARCH_MAX_ROWS = 1024
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _match_condition(value, cond) -> bool:
+    if not isinstance(cond, dict):
+        return value == cond
+    for op, operand in cond.items():
+        if op == "$eq":
+            ok = value == operand
+        elif op == "$ne":
+            ok = value != operand
+        elif op == "$in":
+            ok = value in operand
+        elif op == "$nin":
+            ok = value not in operand
+        elif op == "$gt":
+            ok = value is not None and value > operand
+        elif op == "$gte":
+            ok = value is not None and value >= operand
+        elif op == "$lt":
+            ok = value is not None and value < operand
+        elif op == "$lte":
+            ok = value is not None and value <= operand
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not ok:
+            return False
+    return True
+
+
+def match_filter(metadata: dict, flt: Optional[dict]) -> bool:
+    """Evaluate a Pinecone-style metadata filter against a metadata dict"""
+    if not flt:
+        return True
+    for key, cond in flt.items():
+        if key == "$and":
+            if not all(match_filter(metadata, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(match_filter(metadata, c) for c in cond):
+                return False
+        elif not _match_condition(metadata.get(key), cond):
+            return False
+    return True
+
+
+class LocalVectorStore(VectorStore):
+    """
+    On-disk cosine-similarity vector store with exact, IVF or HNSW search.
+
+    Supports the same operations the app uses on PineconeVectorStore:
+    add_documents/add_texts, filtered similarity search (via as_retriever)
+    and delete by ids or metadata filter. Several processes may share one
+    directory; writes are serialised with a file lock and readers pick up
+    other processes' appends on their next query.
+    """
+
+    def __init__(self, embedding: Embeddings, path: str, index_type: str = "exact",
+                 nprobe: int = IVF_NPROBE, ef_search: Optional[int] = None):
+        if index_type not in ("exact", "ivf", "hnsw"):
+            raise ValueError(f"Unknown local index type: {index_type}")
+        self._embedding = embedding
+        self.path = path
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._records_path = os.path.join(path, "records.jsonl")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._ivf_path = os.path.join(path, "ivf.npy")
+        self._hnsw_path = os.path.join(path, "hnsw.pkl")
+        self._lock = threading.RLock()
+        # Graph walks run outside _lock; inserting into the graph waits for them
+        self._graph_lock = _ReadWriteLock()
+        # Held by the one thread inserting rows into (or saving) the graph
+        self._index_lock = threading.Lock()
+        self._reset()
+        self._refresh()
+        if index_type == "hnsw":
+            atexit.register(_flush_at_exit, weakref.ref(self))
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    # ------------------------------------------------------------------ #
+    # Persistence
+    # ------------------------------------------------------------------ #
+    def _reset(self):
+        self._dim = None
+        self._generation = None
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._alive_flags = bytearray()
+        self._alive = np.zeros(0, dtype=bool)
+        self._postings = defaultdict(lambda: defaultdict(list))
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._log_offset = 0
+        self._centroids = None
+        self._centroids_mtime = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._hnsw = None
+        self._hnsw_mtime = None
+        self._hnsw_saved_rows = 0
+
+    def _read_meta(self) -> dict:
+        if not os.path.exists(self._meta_path):
+            return {}
+        with open(self._meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: dict):
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+
+    def _file_lock(self):
+        return _FileLock(os.path.join(self.path, ".lock"))
+
+    def _refresh(self):
+        """Apply records appended since the last read (by any process)"""
+        with self._lock:
+            meta = self._read_meta()
+            if meta.get("generation") != self._generation:
+                self._reset()
+                self._generation = meta.get("generation")
+            self._dim = meta.get("dim", self._dim)
+
+            if os.path.exists(self._records_path) and \
+                    os.path.getsize(self._records_path) != self._log_offset:
+                first_new_row = len(self._ids)
+                with open(self._records_path, "rb") as f:
+                    f.seek(self._log_offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # partially written by another process
+                        self._log_offset += len(line)
+                        self._apply(json.loads(line))
+                self._alive = np.frombuffer(bytes(self._alive_flags), dtype=bool)
+                self._map_vectors()
+                if self._centroids is not None and len(self._ids) > first_new_row:
+                    self._assign = np.concatenate([
+                        self._assign,
+                        self._nearest_centroid(self._vectors[first_new_row:])])
+
+            self._load_ivf()
+            self._sync_hnsw()
+
+    def _apply(self, record: dict):
+        if record["op"] == "add":
+            old_row = self._id_to_row.get(record["id"])
+            if old_row is not None:
+                self._alive_flags[old_row] = 0
+            row = len(self._ids)
+            self._ids.append(record["id"])
+            self._texts.append(record["text"])
+            self._metadatas.append(record["metadata"])
+            self._id_to_row[record["id"]] = row
+            self._alive_flags.append(1)
+            for key, value in record["metadata"].items():
+                if isinstance(value, (str, int, float, bool)):
+                    self._postings[key][value].append(row)
+        elif record["op"] == "delete":
+            row = self._id_to_row.pop(record["id"], None)
+            if row is not None:
+                self._alive_flags[row] = 0
+
+    def _map_vectors(self):
+        rows = len(self._ids)
+        if rows == 0 or not self._dim:
+            self._vectors = np.zeros((0, self._dim or 0), dtype=np.float32)
+            return
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32,
+                                  mode="r", shape=(rows, self._dim))
+
+    def _truncate_tail(self):
+        """
+        Drop bytes past the last complete append: vectors whose records never
+        made it to the log and a partially written record line. Only called
+        under the file lock, so no other process is mid-append.
+        """
+        for path, size in ((self._vectors_path, len(self._ids) * 4 * (self._dim or 0)),
+                           (self._records_path, self._log_offset)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _append(self, vectors: np.ndarray, records: List[dict]):
+        # Serialise first, so a record that cannot be encoded fails before
+        # either file is touched
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with self._lock, self._file_lock():
+            self._refresh()
+            self._truncate_tail()
+            meta = self._read_meta()
+            if vectors is not None and len(vectors):
+                if meta.get("dim") is None:
+                    meta.setdefault("generation", uuid.uuid4().hex)
+                    meta["dim"] = int(vectors.shape[1])
+                    self._write_meta(meta)
+                    self._generation = meta["generation"]
+                    self._dim = meta["dim"]
+                elif meta["dim"] != vectors.shape[1]:
+                    raise ValueError(
+                        f"Embedding dimension {vectors.shape[1]} does not match index dimension {meta['dim']}")
+                with open(self._vectors_path, "ab") as f:
+                    f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            # Records follow their vectors: a crash in between leaves
+            # unreferenced rows, which the next append truncates
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self._refresh()
+        if self.index_type == "ivf":
+            self._maybe_train()
+        elif self.index_type == "hnsw":
+            self._index_new_rows()
+
+    # ------------------------------------------------------------------ #
+    # VectorStore API
+    # ------------------------------------------------------------------ #
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[dict]] = None,
+                       ids: Optional[List[str]] = None) -> List[str]:
+        """Add precomputed embeddings; an existing id is replaced (upsert)"""
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        records = [
+            {"op": "add", "id": str(i), "text": t, "metadata": m or {}}
+            for i, t, m in zip(ids, texts, metadatas)
+        ]
+        self._append(vectors, records)
+        return [str(i) for i in ids]
+
+    def add_documents(self, documents: List[Document], **kwargs: Any) -> List[str]:
+        ids = kwargs.pop("ids", None)
+        if ids is None and all(getattr(d, "id", None) for d in documents):
+            ids = [d.id for d in documents]
+        return self.add_texts([d.page_content for d in documents],
+                              [d.metadata for d in documents], ids=ids)
+
+    def delete(self, ids: Optional[List[str]] = None, filter: Optional[dict] = None,
+               **kwargs: Any) -> bool:
+        """Delete vectors by id list and/or metadata filter"""
+        with self._lock:
+            self._refresh()
+            targets = set(ids or [])
+            if filter:
+                rows = self._filter_rows(filter)
+                targets.update(self._ids[r] for r in rows)
+            targets = [i for i in targets if i in self._id_to_row]
+        if targets:
+            self._append(None, [{"op": "delete", "id": i} for i in targets])
+        return True
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        with self._lock:
+            self._refresh()
+            return [self._document(self._id_to_row[i]) for i in ids if i in self._id_to_row]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter=filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        vector = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(vector, k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in
+                self.similarity_search_by_vector_with_score(embedding, k, filter=filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None
+                                               ) -> List[Tuple[Document, float]]:
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            if not len(self._ids):
+                return []
+            rows = self._filter_rows(filter) if filter else None
+            vectors, alive = self._vectors, self._alive
+            centroids, assign = self._centroids, self._assign
+            ids, texts, metadatas = self._ids, self._texts, self._metadatas
+
+            hnsw = self._hnsw
+            use_hnsw = hnsw is not None and (rows is None or len(rows) > EXACT_SEARCH_MAX_ROWS)
+            if use_hnsw:
+                # Taken under _lock, so no rows are inserted between the
+                # snapshot above and the graph walk below
+                self._graph_lock.acquire_read()
+
+        if use_hnsw:
+            allowed = alive
+            if rows is not None:
+                allowed = np.zeros(len(alive), dtype=bool)
+                allowed[rows] = True
+                allowed &= alive
+            try:
+                indexed = len(hnsw)
+                hits = hnsw.search(query, vectors, k, ef=self.ef_search,
+                                   accept=lambda row: allowed[row])
+            finally:
+                self._graph_lock.release_read()
+            # Rows not in the graph yet (appended by another process, or
+            # still being inserted) are scanned exactly and merged in
+            tail = np.arange(indexed, len(allowed))
+            tail = tail[allowed[tail]]
+            if len(tail):
+                sims = np.asarray(vectors[tail] @ query)
+                hits = sorted(hits + [(float(s), int(r)) for s, r in zip(sims, tail)],
+                              reverse=True)[:k]
+            return [(Document(page_content=texts[row], metadata=dict(metadatas[row]),
+                              id=ids[row]), sim) for sim, row in hits]
+
+        if centroids is not None and (rows is None or len(rows) > EXACT_SEARCH_MAX_ROWS):
+            nearest = np.argsort(-(centroids @ query))[:self.nprobe]
+            probed = np.nonzero(np.isin(assign, nearest))[0]
+            probed_rows = probed if rows is None else np.intersect1d(rows, probed)
+            probed_rows = probed_rows[alive[probed_rows]]
+            if len(probed_rows) >= k:
+                rows = probed_rows
+
+        if rows is None:
+            scores = np.asarray(vectors @ query)
+            scores[~alive] = -np.inf
+            candidates = np.arange(len(scores))
+            k = min(k, int(alive.sum()))
+        else:
+            candidates = rows[alive[rows]]
+            scores = np.asarray(vectors[candidates] @ query)
+            k = min(k, len(candidates))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            row = int(candidates[i])
+            doc = Document(page_content=texts[row], metadata=dict(metadatas[row]), id=ids[row])
+            results.append((doc, float(scores[i])))
+        return results
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                   path: str = LOCAL_INDEX_DIR, index_type: str = LOCAL_INDEX_TYPE,
+                   **kwargs: Any) -> "LocalVectorStore":
+        store = cls(embedding, path, index_type=index_type)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return int(self._alive.sum())
+
+    # ------------------------------------------------------------------ #
+    # Filtering
+    # ------------------------------------------------------------------ #
+    def _document(self, row: int) -> Document:
+        return Document(page_content=self._texts[row],
+                        metadata=dict(self._metadatas[row]), id=self._ids[row])
+
+    def _posting_rows(self, flt: dict):
+        """Resolve equality/$in filters from postings; None if not possible"""
+        result = None
+        for key, cond in flt.items():
+            if key.startswith("$"):
+                return None
+            if isinstance(cond, dict):
+                if set(cond) == {"$eq"}:
+                    values = [cond["$eq"]]
+                elif set(cond) == {"$in"}:
+                    values = list(cond["$in"])
+                else:
+                    return None
+            else:
+                values = [cond]
+            rows = set()
+            for value in values:
+                if isinstance(value, (str, int, float, bool)):
+                    rows.update(self._postings[key].get(value, ()))
+            result = rows if result is None else result & rows
+        return result
+
+    def _filter_rows(self, flt: dict) -> np.ndarray:
+        rows = self._posting_rows(flt)
+        if rows is None:
+            rows = [r for r in range(len(self._ids))
+                    if self._alive[r] and match_filter(self._metadatas[r], flt)]
+        rows = np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+        return rows[self._alive[rows]] if len(rows) else rows
+
+    # ------------------------------------------------------------------ #
+    # HNSW graph index
+    # ------------------------------------------------------------------ #
+    def _sync_hnsw(self):
+        """Load the persisted graph if it covers more rows than this one"""
+        if self.index_type != "hnsw":
+            return
+        if os.path.exists(self._hnsw_path):
+            mtime = os.path.getmtime(self._hnsw_path)
+            if mtime != self._hnsw_mtime:
+                self._hnsw_mtime = mtime
+                with open(self._hnsw_path, "rb") as f:
+                    state = pickle.load(f)
+                size = len(state["links"])
+                if state.get("generation") == self._generation and \
+                        len(self._hnsw or ()) < size <= len(self._ids):
+                    self._hnsw = HNSWIndex.from_state(state)
+                    self._hnsw_saved_rows = size
+        if self._hnsw is None:
+            self._hnsw = HNSWIndex()
+
+    def _index_new_rows(self):
+        """
+        Insert rows missing from the graph, on the calling (writing) thread.
+
+        Only _graph_lock is held per insert, so searches keep running and
+        scan the rows not inserted yet exactly. If another thread is already
+        inserting, it picks up these rows as well.
+        """
+        while True:
+            if not self._index_lock.acquire(blocking=False):
+                return
+            try:
+                while True:
+                    with self._lock:
+                        self._refresh()
+                        hnsw, vectors = self._hnsw, self._vectors
+                        row = len(hnsw)
+                        if row >= len(self._ids):
+                            break
+                    with self._graph_lock.write():
+                        hnsw.add(row, vectors)
+                    if len(hnsw) - self._hnsw_saved_rows >= HNSW_SAVE_EVERY:
+                        self._save_hnsw()
+            finally:
+                self._index_lock.release()
+            # Rows appended while the lock was being released
+            with self._lock:
+                if len(self._hnsw) >= len(self._ids):
+                    return
+
+    def _save_hnsw(self):
+        """Persist the graph; callers hold _index_lock, so it does not change meanwhile"""
+        with self._lock:
+            hnsw, generation = self._hnsw, self._generation
+        state = hnsw.state()
+        state["generation"] = generation
+        tmp = f"{self._hnsw_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._file_lock():
+            if self._hnsw is not hnsw or self._read_meta().get("generation") != generation:
+                os.remove(tmp)  # superseded by a reload or a compaction
+                return
+            os.replace(tmp, self._hnsw_path)
+            self._hnsw_mtime = os.path.getmtime(self._hnsw_path)
+            self._hnsw_saved_rows = len(hnsw)
+
+    def flush(self):
+        """Wait for graph inserts in progress, then save rows not saved yet"""
+        with self._index_lock:
+            if self._hnsw is None or len(self._hnsw) == self._hnsw_saved_rows:
+                return
+            self._save_hnsw()
+
+    # ------------------------------------------------------------------ #
+    # IVF (inverted file) index
+    # ------------------------------------------------------------------ #
+    def _load_ivf(self):
+        if self.index_type != "ivf" or not os.path.exists(self._ivf_path):
+            return
+        mtime = os.path.getmtime(self._ivf_path)
+        if mtime == self._centroids_mtime:
+            return
+        self._centroids = np.load(self._ivf_path)
+        self._centroids_mtime = mtime
+        self._assign = self._nearest_centroid(self._vectors) if len(self._ids) \
+            else np.zeros(0, dtype=np.int32)
+
+    def _nearest_centroid(self, vectors: np.ndarray) -> np.ndarray:
+        if not len(vectors):
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(np.asarray(vectors) @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _maybe_train(self):
+        alive = int(self._alive.sum())
+        trained_on = self._read_meta().get("ivf_trained_on", 0)
+        if alive >= IVF_MIN_TRAIN and alive >= 2 * trained_on:
+            self.train_ivf()
+
+    def train_ivf(self, nlist: Optional[int] = None, iterations: int = 10,
+                  sample_size: int = 50000, seed: int = 0):
+        """Train IVF centroids with spherical k-means over the live vectors"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            data = np.asarray(self._vectors[np.nonzero(self._alive)[0]])
+            if not len(data):
+                return
+            nlist = nlist or max(1, int(np.sqrt(len(data))))
+            rng = np.random.default_rng(seed)
+            if len(data) > sample_size:
+                data = data[rng.choice(len(data), sample_size, replace=False)]
+            centroids = data[rng.choice(len(data), min(nlist, len(data)), replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                for c in range(len(centroids)):
+                    members = data[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            tmp = self._ivf_path + ".tmp.npy"
+            np.save(tmp, centroids.astype(np.float32))
+            os.replace(tmp, self._ivf_path)
+            meta = self._read_meta()
+            meta["ivf_trained_on"] = int(self._alive.sum())
+            self._write_meta(meta)
+            self._centroids_mtime = None
+            self._load_ivf()
+
+    def compact(self):
+        """Rewrite the index files without deleted rows"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            live = np.nonzero(self._alive)[0]
+            vectors = np.asarray(self._vectors[live]) if len(live) else None
+            records = [{"op": "add", "id": self._ids[r], "text": self._texts[r],
+                        "metadata": self._metadatas[r]} for r in live]
+            for src, suffix in ((self._vectors_path, ".tmp"), (self._records_path, ".tmp")):
+                if os.path.exists(src + suffix):
+                    os.remove(src + suffix)
+            with open(self._vectors_path + ".tmp", "wb") as f:
+                if vectors is not None:
+                    f.write(vectors.astype(np.float32).tobytes())
+            with open(self._records_path + ".tmp", "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            os.replace(self._records_path + ".tmp", self._records_path)
+            meta = self._read_meta()
+            meta["generation"] = uuid.uuid4().hex
+            self._write_meta(meta)
+            self._refresh()
+        if self.index_type == "hnsw":
+            self._index_new_rows()
+            self.flush()
+
+
+class _FileLock:
+    """Exclusive advisory lock on a file, shared across processes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _flush_at_exit(ref):
+    store = ref()
+    if store is None:
+        return
+    try:
+        store.flush()
+    except OSError as e:
+        print(f"Warning: Could not save HNSW graph for {store.path}: {e}")
+
+
+class _ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers block new readers"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+def document_vector_ids(document_id: int, start: int, end: int) -> List[str]:
+    """
+    Vector IDs of chunks [start, end) of an uploaded document.
+
+    IDs depend only on the document and chunk index, so re-sending a chunk
+    overwrites its vector instead of adding a duplicate, and a document's
+    vectors can be deleted by ID without a metadata filter.
+    """
+    return [f"doc-{document_id}-{i}" for i in range(start, end)]
+
+
+def delete_ids(store: VectorStore, ids: List[str], batch_size: int = DELETE_BATCH_SIZE):
+    """Delete vectors by ID in requests of at most `batch_size` IDs"""
+    for start in range(0, len(ids), batch_size):
+        store.delete(ids=ids[start:start + batch_size])
+
+
+def upsert_embeddings(store: VectorStore, texts: List[str], embeddings: List[List[float]],
+                      metadatas: List[dict], ids: Optional[List[str]] = None) -> List[str]:
+    """
+    Write precomputed vectors to a vector store without embedding them again.
+
+    Stores with an add_embeddings method (LocalVectorStore) use it; a
+    PineconeVectorStore is upserted through its index client, storing the
+    text under the store's text key like add_texts does.
+    """
+    if hasattr(store, "add_embeddings"):
+        return store.add_embeddings(texts, embeddings, metadatas=metadatas, ids=ids)
+    index, text_key = getattr(store, "_index", None), getattr(store, "_text_key", None)
+    if index is None or text_key is None:
+        raise TypeError(f"{type(store).__name__} does not accept precomputed embeddings")
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    index.upsert(vectors=[
+        {"id": i, "values": list(map(float, v)), "metadata": {**m, text_key: t}}
+        for i, t, v, m in zip(ids, texts, embeddings, metadatas)
+    ], namespace=getattr(store, "_namespace", None))
+    return ids
+
+
+def embed_and_upsert(store: VectorStore, texts: List[str], metadatas: List[dict],
+                     ids: Optional[List[str]] = None, batch_size: int = EMBED_BATCH_SIZE,
+                     upsert_batch_size: int = UPSERT_BATCH_SIZE,
+                     progress: Optional[Callable[[str, int], None]] = None) -> dict:
+    """
+    Embed texts in batches of `batch_size` and upsert them, see
+    embed_and_upsert_batches. `ids` default to random UUIDs.
+    """
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    batches = ((texts[start:start + batch_size], metadatas[start:start + batch_size],
+                ids[start:start + batch_size], None) for start in range(0, len(texts), batch_size))
+    return embed_and_upsert_batches(store, batches, upsert_batch_size=upsert_batch_size,
+                                    progress=progress)
+
+
+def embed_and_upsert_batches(store: VectorStore,
+                             batches: Iterable[Tuple[List[str], List[dict], Optional[List[str]],
+                                                     Optional[List[List[float]]]]],
+                             upsert_batch_size: int = UPSERT_BATCH_SIZE,
+                             progress: Optional[Callable[[str, int], None]] = None) -> dict:
+    """
+    Embed a stream of chunk batches and upsert them, overlapping the two stages.
+
+    Batch N is upserted on a background thread while batch N+1 is embedded,
+    so the network round trip to Pinecone hides behind the (CPU-bound)
+    embedding step. At most one upsert is in flight and `batches` is pulled
+    lazily on the calling thread, so memory is bounded by the batch size
+    rather than the number of chunks. A failed upsert request is retried up
+    to UPSERT_RETRIES times with backoff; only that request is re-sent, and
+    with stable IDs the retry overwrites anything the failed attempt stored.
+
+    Args:
+        store: Store whose `embeddings` model is used and vectors are written to
+        batches: (texts, metadatas, ids, vectors) tuples; ids None means random
+            UUIDs, vectors None means embed the texts with the store's model
+        upsert_batch_size: Vectors per upsert request
+        progress: Called with ("chunks_embedded", n) from the calling thread and
+            ("vectors_upserted", n) from the upsert thread
+
+    Returns:
+        Dict with the chunk count, elapsed seconds and chunks_per_sec
+    """
+    report = progress or (lambda counter, value: None)
+    upserted = [0]
+
+    def upsert(texts, vectors, metadatas, ids):
+        for start in range(0, len(texts), upsert_batch_size):
+            end = start + upsert_batch_size
+            for attempt in range(UPSERT_RETRIES):
+                try:
+                    upsert_embeddings(store, texts[start:end], vectors[start:end],
+                                      metadatas[start:end], ids=ids[start:end])
+                    break
+                except Exception as e:
+                    if attempt + 1 == UPSERT_RETRIES:
+                        raise
+                    print(f"Upsert of {len(texts[start:end])} vectors failed ({e}), retrying")
+                    time.sleep(0.5 * 2 ** attempt)
+            upserted[0] += len(texts[start:end])
+            report("vectors_upserted", upserted[0])
+
+    started = time.perf_counter()
+    embedded = 0
+    pending = None
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='upsert') as executor:
+        for texts, metadatas, ids, vectors in batches:
+            if not texts:
+                continue
+            ids = ids or [str(uuid.uuid4()) for _ in texts]
+            if vectors is None:
+                vectors = store.embeddings.embed_documents(texts)
+            embedded += len(vectors)
+            report("chunks_embedded", embedded)
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(upsert, texts, vectors, metadatas, ids)
+        if pending is not None:
+            pending.result()
+
+    elapsed = time.perf_counter() - started
+    return {"chunks": embedded, "seconds": elapsed,
+            "chunks_per_sec": embedded / elapsed if elapsed > 0 else 0.0}
+
+
+def get_vector_store(embeddings: Embeddings, index_name: str,
+                     backend: Optional[str] = None) -> VectorStore:
+    """
+    Open the configured vector store for an index.
+
+    Args:
+        embeddings: Embedding model used for queries and inserts
+        index_name: Pinecone index name, or sub-directory of LOCAL_INDEX_DIR
+        backend: "pinecone" or "local" (default: VECTOR_STORE_BACKEND)
+    """
+    backend = backend or VECTOR_STORE_BACKEND
+    if backend == "local":
+        return LocalVectorStore(embeddings, os.path.join(LOCAL_INDEX_DIR, index_name),
+                                index_type=LOCAL_INDEX_TYPE)
+    if backend == "pinecone":
+        from langchain_pinecone import PineconeVectorStore
+        return PineconeVectorStore.from_existing_index(index_name=index_name,
+                                                       embedding=embeddings)
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
@@ -1,46 +1,214 @@
 """
-Script to index PDF documents from data/ folder into Pinecone.
-Run this once to populate the vector store with initial documents.
+Script to index PDF documents from data/ folder into the vector store.
+Set VECTOR_STORE_BACKEND=local to build the on-disk index instead of Pinecone.
+
+Indexing is incremental: a manifest (INDEX_MANIFEST, default
+data/index_manifest.json) records each PDF's SHA-256 and how many of its
+chunks have been upserted. Re-runs only index new or changed files, remove
+the vectors of deleted or changed ones, and resume an interrupted file from
+its last upserted batch. Pass --rebuild to re-index everything.
+
+Pages stream from the parser through splitting into embedding batches, so
+memory depends on EMBED_BATCH_SIZE rather than the size of the corpus.
 """
 from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+from src.helper import iter_minimal_docs, iter_text_chunks, batched, download_hugging_face_embeddings
+from src.pdf_loader import iter_pdf_pages, PDF_PARSE_PROCESSES
+from src.vector_store import (LocalVectorStore, VECTOR_STORE_BACKEND, LOCAL_INDEX_DIR, LOCAL_INDEX_TYPE,
+                              EMBED_BATCH_SIZE, embed_and_upsert_batches, delete_ids)
+import multiprocessing
+import argparse
+import hashlib
+import glob
+import json
 import os
-from src.helper import load_pdf_file, filter_to_minimal_docs, text_split, download_hugging_face_embeddings
-from pinecone import Pinecone
-from langchain_pinecone import PineconeVectorStore
 
 load_dotenv()
 
-PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY not found in environment variables")
-
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
+index_name = "medical-chatbot"
+MANIFEST_PATH = os.environ.get('INDEX_MANIFEST', os.path.join('data', 'index_manifest.json'))
 
 
-extracted_data = load_pdf_file(data='data/')
-filter_data = filter_to_minimal_docs(extracted_data)
-text_chunks = text_split(filter_data)
+def open_vector_store(embeddings):
+    if VECTOR_STORE_BACKEND == "local":
+        return LocalVectorStore(
+            embeddings,
+            os.path.join(LOCAL_INDEX_DIR, index_name),
+            index_type=LOCAL_INDEX_TYPE,
+        )
 
-embeddings = download_hugging_face_embeddings()
+    from pinecone import Pinecone
+    from langchain_pinecone import PineconeVectorStore
 
-pinecone_api_key = PINECONE_API_KEY
-pc = Pinecone(api_key=pinecone_api_key)
+    PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
+    if not PINECONE_API_KEY:
+        raise ValueError("PINECONE_API_KEY not found in environment variables")
+    os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 
+    pc = Pinecone(api_key=PINECONE_API_KEY)
 
-index_name = "medical-chatbot"
+    if not pc.has_index(index_name):
+        pc.create_index(
+            name=index_name,
+            dimension=384,
+            metric="cosine",
+        )
 
-if not pc.has_index(index_name):
-    pc.create_index(
-        name=index_name,
-        dimension=384,
-        metric="cosine",
+    return PineconeVectorStore(
+        index_name=index_name,
+        embedding=embeddings,
     )
 
-index = pc.Index(index_name)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def corpus_vector_ids(name, start, end):
+    """Stable vector IDs for chunks [start, end) of corpus file `name`"""
+    prefix = hashlib.sha256(name.encode('utf-8')).hexdigest()[:16]
+    return [f"global-{prefix}-{i}" for i in range(start, end)]
+
+
+def load_manifest(path, target):
+    """The manifest for `target` (backend:index), or an empty one"""
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("target") == target:
+            return manifest
+        print(f"{path} tracks {manifest.get('target')}, not {target}; starting a new manifest")
+    return {"target": target, "files": {}}
+
+
+def save_manifest(path, manifest):
+    # Write-then-rename so a crash never leaves a truncated manifest
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def delete_file_vectors(store, name, entry):
+    delete_ids(store, corpus_vector_ids(name, 0, entry["chunks_done"]))
+
+
+def index_file(store, name, path, entry, save, executor=None):
+    """Embed and upsert the chunks of one PDF from entry["chunks_done"] on"""
+    resume_from = entry["chunks_done"]
+    if resume_from:
+        print(f"{name}: resuming after {resume_from} chunks")
+    pages = iter_pdf_pages(path, executor=executor, processes=1)
+    chunks = iter_text_chunks(iter_minimal_docs(pages))
+
+    def batches():
+        first = 0
+        for batch in batched(chunks, EMBED_BATCH_SIZE):
+            skip = max(0, resume_from - first)
+            first += len(batch)
+            batch = batch[skip:]
+            if not batch:
+                continue
+            # Tag the shared corpus so per-user queries can match it with a single
+            # user_id filter (see RETRIEVAL_MODE in app.py)
+            for chunk in batch:
+                chunk.metadata['user_id'] = 'global'
+            yield ([chunk.page_content for chunk in batch], [chunk.metadata for chunk in batch],
+                   corpus_vector_ids(name, first - len(batch), first), None)
+
+    def report(counter, value):
+        # Upserts complete in order, so everything before this count is stored
+        if counter == "vectors_upserted":
+            entry["chunks_done"] = resume_from + value
+            save()
+
+    stats = embed_and_upsert_batches(store, batches(), progress=report)
+    entry["complete"] = True
+    save()
+    print(f"{name}: {stats['chunks']} chunks in {stats['seconds']:.1f}s "
+          f"({stats['chunks_per_sec']:.1f} chunks/s)")
+    return stats["chunks"]
+
+
+def index_corpus(store, data='data/', manifest_path=MANIFEST_PATH, target=None, rebuild=False,
+                 processes=PDF_PARSE_PROCESSES):
+    """
+    Bring the vector store in line with the PDFs in `data`.
+
+    Returns:
+        Dict with the number of files indexed, removed and unchanged, and chunks upserted
+    """
+    target = target or f"{VECTOR_STORE_BACKEND}:{index_name}"
+    manifest = load_manifest(manifest_path, target)
+    files = manifest["files"]
+
+    def save():
+        save_manifest(manifest_path, manifest)
+
+    current = {}
+    for path in sorted(glob.glob(os.path.join(data, "*.pdf"))):
+        name = os.path.relpath(path, data)
+        stat = os.stat(path)
+        entry = files.get(name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = file_sha256(path)
+        current[name] = (path, sha256, stat)
+
+    summary = {"indexed": 0, "removed": 0, "unchanged": 0, "chunks": 0}
+    for name, entry in list(files.items()):
+        if rebuild or name not in current or current[name][1] != entry["sha256"]:
+            print(f"{name}: removing {entry['chunks_done']} stale vectors")
+            delete_file_vectors(store, name, entry)
+            del files[name]
+            save()
+            if name not in current:
+                summary["removed"] += 1
+
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) \
+        if processes > 1 else None
+    try:
+        for name, (path, sha256, stat) in current.items():
+            entry = files.get(name)
+            if entry and entry["complete"]:
+                # Same content, possibly touched: refresh the stat shortcut
+                entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                summary["unchanged"] += 1
+                continue
+            if entry is None:
+                entry = files[name] = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime,
+                                       "chunks_done": 0, "complete": False}
+                save()
+            summary["chunks"] += index_file(store, name, path, entry, save, executor=executor)
+            summary["indexed"] += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    save()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data/", help="Directory of PDFs to index")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="Re-index every file")
+    args = parser.parse_args()
+
+    docsearch = open_vector_store(download_hugging_face_embeddings())
+    summary = index_corpus(docsearch, data=args.data, manifest_path=args.manifest, rebuild=args.rebuild)
+    if hasattr(docsearch, "flush"):
+        docsearch.flush()
+    print(f"Indexed {summary['indexed']} files ({summary['chunks']} chunks), removed {summary['removed']}, "
+          f"unchanged {summary['unchanged']}")
 
 
-docsearch = PineconeVectorStore.from_documents(
-    documents=text_chunks,
-    index_name=index_name,
-    embedding=embeddings,
-)
+# Guarded: PDF parse workers are spawned processes, which import this module
+if __name__ == "__main__":
+    main()
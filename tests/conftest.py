@@ -7,6 +7,7 @@ import tempfile
 import shutil
 import threading
 import gc
+from io import BytesIO
 from src.database import db, User, Document, Conversation, Message, Citation, Feedback, DocumentChunk
 
 # Set testing environment BEFORE importing app to prevent global resource creation
@@ -15,6 +16,7 @@ os.environ["PYTEST_CURRENT_TEST"] = "1"
 
 from app import app as flask_app
 from werkzeug.security import generate_password_hash
+from tests.test_utils import RecordingStore, three_chunks, unique_pdf_bytes
 
 
 @pytest.fixture(scope='session')
@@ -181,6 +183,27 @@ def mock_gemini(monkeypatch):
     monkeypatch.setattr('langchain_google_genai.ChatGoogleGenerativeAI', lambda *args, **kwargs: MockLLM())
 
 
+@pytest.fixture
+def recording_store(monkeypatch):
+    """Replace the app's vector store with a RecordingStore"""
+    import app as app_module
+    store = RecordingStore()
+    monkeypatch.setattr(app_module, 'docsearch', store)
+    return store
+
+
+@pytest.fixture
+def upload_pdf(authenticated_client, recording_store, monkeypatch):
+    """Upload a PDF whose chunks come from `loader`, indexed into recording_store"""
+    import src.ingestion as ingestion_module
+
+    def upload(content=None, filename='guide.pdf', loader=three_chunks):
+        monkeypatch.setattr(ingestion_module, 'load_document_chunks', loader)
+        data = {'file': (BytesIO(content or unique_pdf_bytes()), filename)}
+        return authenticated_client.post('/api/upload', data=data, content_type='multipart/form-data')
+    return upload
+
+
 @pytest.fixture(autouse=True)
 def cleanup_after_test(app):
     """Clean up database after each test"""
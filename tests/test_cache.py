@@ -0,0 +1,123 @@
+"""Tests for in-process caches"""
+import pytest
+import time
+from src.cache import LRUCache, CachedEmbeddings, normalize_query
+
+
+class CountingEmbeddings:
+    """Embeddings stub that counts model calls"""
+
+    def __init__(self):
+        self.query_calls = 0
+
+    def embed_query(self, text):
+        self.query_calls += 1
+        return [float(len(text))] * 4
+
+    def embed_documents(self, texts):
+        return [[float(len(t))] * 4 for t in texts]
+
+
+class TestLRUCache:
+    """Tests for LRUCache"""
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest untouched entry is evicted first"""
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_ttl_expiry(self):
+        """Test entries expire after the TTL"""
+        cache = LRUCache(maxsize=10, ttl=0.05)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        time.sleep(0.08)
+        assert cache.get("a") is None
+
+    def test_hit_miss_counters(self):
+        """Test hits and misses are counted"""
+        cache = LRUCache(maxsize=10)
+        cache.get("a")
+        cache.set("a", 1)
+        cache.get("a")
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+
+class TestCachedEmbeddings:
+    """Tests for the query-embedding cache wrapper"""
+
+    def test_normalized_queries_share_entry(self):
+        """Test case and whitespace variants hit the same cache entry"""
+        model = CountingEmbeddings()
+        embeddings = CachedEmbeddings(model, maxsize=10)
+        first = embeddings.embed_query("What is  Diabetes")
+        second = embeddings.embed_query("what is diabetes ")
+        assert first == second
+        assert model.query_calls == 1
+        assert embeddings.cache.stats()["hits"] == 1
+
+    def test_documents_bypass_cache(self):
+        """Test embed_documents is passed through uncached"""
+        embeddings = CachedEmbeddings(CountingEmbeddings(), maxsize=10)
+        assert len(embeddings.embed_documents(["a", "bb"])) == 2
+        assert len(embeddings.cache) == 0
+
+    def test_normalize_query(self):
+        """Test query normalization"""
+        assert normalize_query("  Symptoms   of\tDIABETES ") == "symptoms of diabetes"
+
+
+class TestSemanticAnswerCache:
+    """Tests for the semantic answer cache"""
+
+    def test_similar_query_hits_within_scope(self):
+        """Test a near-identical vector returns the cached answer"""
+        from src.cache import SemanticAnswerCache, answer_cache_scope
+        cache = SemanticAnswerCache(threshold=0.95)
+        scope = answer_cache_scope(1, [])
+        cache.store(scope, [1.0, 0.0, 0.0], "Cached answer", ["doc"])
+
+        hit = cache.lookup(scope, [0.99, 0.05, 0.0])
+        assert hit["answer"] == "Cached answer"
+        assert hit["docs"] == ["doc"]
+        assert cache.lookup(scope, [0.0, 1.0, 0.0]) is None
+
+    def test_scopes_never_cross_document_sets(self):
+        """Test answers do not leak between users with different uploads"""
+        from src.cache import SemanticAnswerCache, answer_cache_scope
+        cache = SemanticAnswerCache(threshold=0.9)
+        cache.store(answer_cache_scope(1, [10]), [1.0, 0.0], "User 1 answer", [])
+
+        assert cache.lookup(answer_cache_scope(2, [11]), [1.0, 0.0]) is None
+        assert cache.lookup(answer_cache_scope(2, []), [1.0, 0.0]) is None
+        assert cache.lookup(answer_cache_scope(1, [10, 12]), [1.0, 0.0]) is None
+        assert cache.lookup(answer_cache_scope(1, [10]), [1.0, 0.0]) is not None
+
+    def test_invalidate_user(self):
+        """Test invalidation drops only that user's scopes"""
+        from src.cache import SemanticAnswerCache, answer_cache_scope
+        cache = SemanticAnswerCache(threshold=0.9)
+        cache.store(answer_cache_scope(1, [10]), [1.0, 0.0], "User 1", [])
+        cache.store(answer_cache_scope(2, []), [1.0, 0.0], "Global", [])
+
+        cache.invalidate_user(1)
+        assert cache.lookup(answer_cache_scope(1, [10]), [1.0, 0.0]) is None
+        assert cache.lookup(answer_cache_scope(2, []), [1.0, 0.0])["answer"] == "Global"
+
+    def test_ttl_expiry(self):
+        """Test cached answers expire"""
+        from src.cache import SemanticAnswerCache, answer_cache_scope
+        cache = SemanticAnswerCache(threshold=0.9, ttl=0.05)
+        scope = answer_cache_scope(1, [])
+        cache.store(scope, [1.0, 0.0], "Answer", [])
+        time.sleep(0.08)
+        assert cache.lookup(scope, [1.0, 0.0]) is None
@@ -1,8 +1,8 @@
 """Tests for chat API endpoints"""
 import pytest
 import json
-from src.database import db, Conversation, Message
-from tests.test_utils import consume_stream
+from src.database import db, Conversation, Message, Citation, Feedback, Document
+from tests.test_utils import consume_stream, count_queries, sse_events
 
 
 class TestChatStream:
@@ -41,6 +41,19 @@ class TestChatStream:
             assert len(messages) >= 1
             assert any(msg.role == 'user' for msg in messages)
 
+    def test_disconnect_discards_reserved_answer(self, authenticated_client, app, test_user):
+        """Test a client that disconnects mid-stream leaves no empty assistant message"""
+        response = authenticated_client.post('/api/chat/stream', json={'message': 'Test question'},
+                                             buffered=False)
+        next(iter(response.response))  # heartbeat
+        response.close()
+
+        with app.app_context():
+            conversation = Conversation.query.filter_by(
+                user_id=test_user.id).order_by(Conversation.id.desc()).first()
+            messages = Message.query.filter_by(conversation_id=conversation.id).all()
+            assert [msg.role for msg in messages] == ['user']
+
 
 class TestConversationsAPI:
     """Tests for conversations API endpoints"""
@@ -82,6 +95,46 @@ class TestConversationsAPI:
         assert 'id' in data[0]
         assert 'message_count' in data[0]
     
+    def test_get_conversations_single_query(self, authenticated_client, app, test_user):
+        """Test counts and previews are aggregated in one query, not per conversation"""
+        with app.app_context():
+            test_user = db.session.merge(test_user)
+            created = set()
+            for i in range(5):
+                conv = Conversation(user_id=test_user.id)
+                db.session.add(conv)
+                db.session.flush()
+                created.add(conv.id)
+                db.session.add(Message(conversation_id=conv.id, role='user', content=f'Question {i} ' + 'x' * 200))
+                db.session.add(Message(conversation_id=conv.id, role='assistant', content='Answer'))
+            db.session.commit()
+
+            with count_queries(db.engine) as statements:
+                response = authenticated_client.get('/api/conversations')
+
+        assert response.status_code == 200
+        # Earlier tests may have left conversations for the same user
+        data = [c for c in json.loads(response.data) if c['id'] in created]
+        assert len(data) == 5
+        assert all(c['message_count'] == 2 for c in data)
+        assert all(c['preview'].startswith('Question') and len(c['preview']) == 100 for c in data)
+        assert sum('messages' in s for s in statements) == 1
+
+    def test_reserved_answer_hidden_until_persisted(self, authenticated_client, app, test_conversation):
+        """Test the empty assistant row reserved by chat_stream is not listed or counted"""
+        with app.app_context():
+            conversation_id = test_conversation.id
+            Message.query.filter_by(conversation_id=conversation_id).delete()
+            db.session.add_all([
+                Message(conversation_id=conversation_id, role='user', content='Question'),
+                Message(conversation_id=conversation_id, role='assistant', content='')])
+            db.session.commit()
+
+        messages = json.loads(authenticated_client.get(f'/api/conversations/{conversation_id}/messages').data)
+        assert [m['role'] for m in messages] == ['user']
+        conversations = json.loads(authenticated_client.get('/api/conversations').data)
+        assert next(c for c in conversations if c['id'] == conversation_id)['message_count'] == 1
+
     def test_get_messages_success(self, authenticated_client, app, test_conversation, test_message):
         """Test get messages returns conversation messages"""
         with app.app_context():
@@ -106,3 +159,292 @@ class TestConversationsAPI:
         assert isinstance(data, list)
         assert len(data) > 0
         assert any(msg['id'] == test_message.id for msg in data)
+
+    def test_get_messages_constant_queries(self, authenticated_client, app, test_conversation, test_document):
+        """Test get messages query count does not grow with conversation length"""
+        conversation_id = test_conversation.id
+
+        def add_turns(count):
+            with app.app_context():
+                doc = db.session.merge(test_document)
+                for i in range(count):
+                    answer = Message(conversation_id=conversation_id, role='assistant', content=f'Answer {i}')
+                    db.session.add(answer)
+                    db.session.flush()
+                    db.session.add(Citation(message_id=answer.id, document_id=doc.id, page_number=i, content_snippet='snippet'))
+                    db.session.add(Citation(message_id=answer.id, document_id=None, page_number=i, content_snippet='snippet'))
+                    db.session.add(Feedback(user_id=doc.user_id, message_id=answer.id, rating='positive'))
+                db.session.commit()
+
+        def fetch():
+            with app.app_context():
+                with count_queries(db.engine) as statements:
+                    response = authenticated_client.get(f'/api/conversations/{conversation_id}/messages')
+            assert response.status_code == 200
+            return json.loads(response.data), len(statements)
+
+        add_turns(2)
+        _, short_count = fetch()
+        add_turns(10)
+        data, long_count = fetch()
+
+        assert long_count == short_count
+        answers = [m for m in data if m['role'] == 'assistant']
+        assert len(answers) == 12
+        assert all(m['feedback'] == 'positive' for m in answers)
+        assert all(sorted(c['source'] for c in m['citations']) == ['Unknown', 'test.pdf'] for m in answers)
+
+    def test_get_messages_keyset_pagination(self, authenticated_client, app, test_conversation):
+        """Test limit/before pages backwards through history without gaps"""
+        conversation_id = test_conversation.id
+        with app.app_context():
+            for i in range(5):
+                db.session.add(Message(conversation_id=conversation_id, role='user', content=f'Question {i}'))
+                db.session.flush()
+                answer = Message(conversation_id=conversation_id, role='assistant', content=f'Answer {i}')
+                db.session.add(answer)
+                db.session.flush()
+                db.session.add(Citation(message_id=answer.id, page_number=i, content_snippet='snippet'))
+            db.session.commit()
+
+        url = f'/api/conversations/{conversation_id}/messages'
+        first = authenticated_client.get(url, query_string={'limit': 4})
+        pages = [json.loads(first.data)]
+        cursor = first.headers.get('X-Next-Before')
+        while cursor:
+            response = authenticated_client.get(url, query_string={'limit': 4, 'before': cursor, 'lite': 1})
+            pages.insert(0, json.loads(response.data))
+            cursor = response.headers.get('X-Next-Before')
+
+        assert [len(p) for p in pages] == [2, 4, 4]
+        contents = [m['content'] for page in pages for m in page]
+        assert contents == [f'{kind} {i}' for i in range(5) for kind in ('Question', 'Answer')]
+        assert 'preview' in pages[-1][-1]['citations'][0]
+        assert 'preview' not in pages[0][-1]['citations'][0]
+
+    def test_get_messages_invalid_cursor(self, authenticated_client, test_conversation):
+        """Test a cursor from another conversation is rejected"""
+        response = authenticated_client.get(
+            f'/api/conversations/{test_conversation.id}/messages', query_string={'before': 999999})
+        assert response.status_code == 400
+
+
+class TestChatStreamTokens:
+    """Tests for token-level streaming"""
+
+    def test_chat_stream_forwards_llm_chunks(self, authenticated_client, app, monkeypatch):
+        """Test each LLM chunk is sent as its own token event"""
+        from langchain_core.runnables import Runnable
+        import app as app_module
+
+        class StreamingLLM(Runnable):
+            def invoke(self, input, config=None, **kwargs):
+                return "Rewritten query"
+
+            def stream(self, input, config=None, **kwargs):
+                for chunk in ["Diabetes ", "is ", "a ", "chronic ", "condition."]:
+                    yield chunk
+
+        monkeypatch.setattr(app_module, 'llm', StreamingLLM())
+
+        response = authenticated_client.post('/api/chat/stream', json={'message': 'What is diabetes?'})
+        assert response.status_code == 200
+
+        events = sse_events(response)
+        tokens = [e['content'] for e in events if e['type'] == 'token']
+        assert tokens == ["Diabetes ", "is ", "a ", "chronic ", "condition."]
+        assert events[-1]['type'] == 'done'
+
+        with app.app_context():
+            msg = Message.query.get(events[-1]['message_id'])
+            assert msg.content == "Diabetes is a chronic condition."
+
+    def test_advanced_rag_sends_status_events(self, authenticated_client, app, monkeypatch):
+        """Test advanced RAG reports each stage before streaming the answer"""
+        from langchain_core.runnables import Runnable
+        import app as app_module
+
+        class MultiHopLLM(Runnable):
+            def invoke(self, input, config=None, **kwargs):
+                prompt = input.to_messages()[-1].content
+                if prompt.startswith("Question:"):
+                    return 'MULTI_HOP: ["first hop", "second hop"]'
+                return "Rewritten query"
+
+            def stream(self, input, config=None, **kwargs):
+                yield from ["Combined ", "answer."]
+
+        monkeypatch.setattr(app_module, 'llm', MultiHopLLM())
+
+        response = authenticated_client.post('/api/chat/stream', json={
+            'message': 'Compare metformin and insulin', 'use_advanced_rag': True})
+        events = sse_events(response)
+        types = [e['type'] for e in events]
+
+        assert 'status' in types
+        assert types.index('status') < types.index('token')
+        assert [e['stage'] for e in events if e['type'] == 'status'][-1] == 'synthesizing'
+        assert [e['content'] for e in events if e['type'] == 'token'] == ["Combined ", "answer."]
+        assert events[-1]['type'] == 'done'
+
+
+class TestScopedRetrieval:
+    """Tests for single-query scoped retrieval mode"""
+
+    def test_single_mode_uses_one_filtered_query(self, authenticated_client, app, test_user, monkeypatch):
+        """Test single mode issues one query with a user_id OR-filter"""
+        from langchain_core.documents import Document as LCDocument
+        import app as app_module
+
+        with app.app_context():
+            test_user = db.session.merge(test_user)
+            user_id = test_user.id
+
+        calls = []
+
+        class RecordingStore:
+            def as_retriever(self, **kwargs):
+                calls.append(kwargs)
+
+                class Retriever:
+                    def invoke(self, query):
+                        return [
+                            LCDocument(page_content="global", metadata={"user_id": "global"}),
+                            LCDocument(page_content="other", metadata={"user_id": "someone-else"}),
+                        ]
+                return Retriever()
+
+        monkeypatch.setattr(app_module, 'RETRIEVAL_MODE', 'single')
+        monkeypatch.setattr(app_module, 'docsearch', RecordingStore())
+
+        response = authenticated_client.post('/api/chat/stream', json={'message': 'What is hypertension?'})
+        events = sse_events(response)
+
+        assert len(calls) == 1
+        assert calls[0]['search_kwargs']['filter'] == {"user_id": {"$in": [str(user_id), "global"]}}
+        citations = next(e for e in events if e['type'] == 'citations')['citations']
+        assert [c['preview'] for c in citations] == ["global"]
+
+
+class TestAnswerCache:
+    """Tests for semantic answer caching in chat_stream"""
+
+    def test_repeated_question_skips_llm(self, authenticated_client, app, test_user, monkeypatch):
+        """Test a repeated question is answered from the cache"""
+        from langchain_core.runnables import Runnable
+        from src.cache import SemanticAnswerCache
+        import app as app_module
+
+        with app.app_context():
+            # Uploads still being indexed disable caching
+            Document.query.filter_by(user_id=test_user.id).delete()
+            db.session.commit()
+
+        class CountingLLM(Runnable):
+            calls = 0
+
+            def invoke(self, input, config=None, **kwargs):
+                CountingLLM.calls += 1
+                return "Hypertension is high blood pressure."
+
+        class FixedEmbeddings:
+            def embed_query(self, text):
+                return [1.0, 0.0, 0.0]
+
+        monkeypatch.setattr(app_module, 'llm', CountingLLM())
+        monkeypatch.setattr(app_module, 'embeddings', FixedEmbeddings())
+        monkeypatch.setattr(app_module, 'answer_cache', SemanticAnswerCache())
+
+        def ask():
+            response = authenticated_client.post('/api/chat/stream', json={'message': 'What is hypertension?'})
+            events = sse_events(response)
+            return "".join(e['content'] for e in events if e['type'] == 'token'), events
+
+        first, _ = ask()
+        calls_after_first = CountingLLM.calls
+        second, events = ask()
+
+        assert first == second == "Hypertension is high blood pressure."
+        assert CountingLLM.calls == calls_after_first
+        assert events[-1]['type'] == 'done'
+
+    def test_answer_from_upload_in_progress_is_not_cached(self, authenticated_client, app, test_user,
+                                                          monkeypatch):
+        """Test a user whose upload is still indexing never stores answers in the shared scope"""
+        from langchain_core.documents import Document as LCDocument
+        from src.cache import SemanticAnswerCache
+        from src.database import DocumentStatus
+        import app as app_module
+
+        with app.app_context():
+            Document.query.filter_by(user_id=test_user.id).delete()
+            db.session.add(Document(user_id=test_user.id, filename='p.pdf', original_filename='p.pdf',
+                                    file_path='/test/p.pdf', status=DocumentStatus.PROCESSING))
+            db.session.commit()
+            user_id = test_user.id
+
+        class PrivateChunkStore:
+            def as_retriever(self, **kwargs):
+                class Retriever:
+                    def invoke(self, query):
+                        return [LCDocument(page_content="private notes", metadata={"user_id": str(user_id)})]
+                return Retriever()
+
+        class FixedEmbeddings:
+            def embed_query(self, text):
+                return [1.0, 0.0, 0.0]
+
+        cache = SemanticAnswerCache()
+        monkeypatch.setattr(app_module, 'RETRIEVAL_MODE', 'single')
+        monkeypatch.setattr(app_module, 'docsearch', PrivateChunkStore())
+        monkeypatch.setattr(app_module, 'embeddings', FixedEmbeddings())
+        monkeypatch.setattr(app_module, 'answer_cache', cache)
+
+        response = authenticated_client.post('/api/chat/stream', json={'message': 'What is in my notes?'})
+        events = sse_events(response)
+        assert events[-1]['type'] == 'done'
+        assert cache.lookup(("global", "plain"), [1.0, 0.0, 0.0]) is None
+        with app.app_context():
+            Document.query.filter_by(user_id=user_id).delete()
+            db.session.commit()
+
+
+class TestCitationPersistence:
+    """Tests for bulk citation persistence in chat_stream"""
+
+    def test_citations_use_metadata_ids(self, authenticated_client, app, test_document, monkeypatch):
+        """Test citations take document/chunk IDs from vector metadata and drop stale ones"""
+        from langchain_core.documents import Document as LCDocument
+        from src.database import DocumentChunk
+        import app as app_module
+
+        with app.app_context():
+            chunk = DocumentChunk(document_id=test_document.id, chunk_index=0, page_number=3)
+            db.session.add(chunk)
+            db.session.commit()
+            doc_id, chunk_id = test_document.id, chunk.id
+
+        docs = [
+            LCDocument(page_content="uploaded", metadata={
+                "user_id": "global", "document_id": str(doc_id), "chunk_id": str(chunk_id), "page": 3.0}),
+            LCDocument(page_content="deleted", metadata={
+                "user_id": "global", "document_id": "999999", "chunk_id": "999999", "page": 1}),
+            LCDocument(page_content="corpus", metadata={"user_id": "global", "source": "data/Medical_book.pdf"}),
+        ]
+
+        class FixedRetriever:
+            def invoke(self, query):
+                return docs
+
+        monkeypatch.setattr(app_module, 'retriever', FixedRetriever())
+
+        response = authenticated_client.post('/api/chat/stream', json={'message': 'What is anemia?'})
+        events = sse_events(response)
+        types = [e['type'] for e in events]
+        assert types.index('citations') < types.index('done')
+
+        with app.app_context():
+            citations = Citation.query.filter_by(message_id=events[-1]['message_id'])\
+                .order_by(Citation.id).all()
+            assert [(c.document_id, c.chunk_id, c.page_number) for c in citations] == [
+                (doc_id, chunk_id, 3), (None, None, 1), (None, None, None)]
@@ -140,3 +140,87 @@ class TestMessage:
             db.session.refresh(test_message)
             
             assert len(test_message.citations) == 1
+
+
+class TestIndexes:
+    """Tests for indexes on hot query paths"""
+
+    def test_hot_path_indexes_exist(self, app):
+        """Test create_all builds the declared indexes"""
+        with app.app_context():
+            inspector = db.inspect(db.engine)
+            names = {table: {ix['name'] for ix in inspector.get_indexes(table)}
+                     for table in ('documents', 'document_chunks', 'conversations', 'messages', 'citations', 'feedbacks')}
+            assert {'ix_documents_user_status', 'ix_documents_user_content_hash'} <= names['documents']
+            assert {'ix_document_chunks_document_page', 'ix_document_chunks_content_hash'} <= names['document_chunks']
+            assert 'ix_conversations_user_updated' in names['conversations']
+            assert 'ix_messages_conversation_created' in names['messages']
+            assert {'ix_citations_message_id', 'ix_citations_document_id', 'ix_citations_chunk_id'} <= names['citations']
+            assert 'ix_feedbacks_message_user' in names['feedbacks']
+
+    def test_create_missing_indexes_restores_dropped_index(self, app):
+        """Test existing databases get indexes added after their tables were created"""
+        from src.database import create_missing_indexes
+        with app.app_context():
+            index = next(ix for ix in Message.__table__.indexes if ix.name == 'ix_messages_conversation_created')
+            index.drop(db.engine)
+            create_missing_indexes()
+            create_missing_indexes()
+            names = {ix['name'] for ix in db.inspect(db.engine).get_indexes('messages')}
+            assert 'ix_messages_conversation_created' in names
+
+    def test_add_missing_columns_skips_column_added_concurrently(self, app, monkeypatch):
+        """Test a column another worker added after our inspection is skipped rather than fatal"""
+        from src.database import add_missing_columns
+        real_inspect = db.inspect
+
+        class StaleInspector:
+            """Inspector from before another worker added documents.updated_at"""
+
+            def __init__(self, inspector):
+                self._inspector = inspector
+
+            def get_table_names(self):
+                return self._inspector.get_table_names()
+
+            def get_columns(self, table):
+                columns = self._inspector.get_columns(table)
+                return [c for c in columns if (table, c['name']) != ('documents', 'updated_at')]
+
+        with app.app_context():
+            stale = iter([StaleInspector(real_inspect(db.engine))])
+            monkeypatch.setattr(db, 'inspect', lambda bind: next(stale, None) or real_inspect(bind))
+            assert add_missing_columns() == set()
+
+
+class TestDocumentChunkInsert:
+    """Tests for bulk chunk insertion"""
+
+    def test_insert_returns_ids_in_order(self, app, test_document):
+        """Test one executemany returns IDs matching the input order"""
+        from src.database import insert_document_chunks
+        from tests.test_utils import count_queries
+        with app.app_context():
+            rows = [{'chunk_index': i, 'page_number': i // 10, 'content_preview': f'chunk {i}'}
+                    for i in range(250)]
+            with count_queries(db.engine) as statements:
+                ids = insert_document_chunks(test_document.id, rows)
+            db.session.commit()
+
+            inserts = sum(s.lstrip().upper().startswith('INSERT') for s in statements)
+            if db.engine.dialect.name == 'postgresql':
+                assert inserts < 5
+            else:
+                # SQLite has no sentinel for sort_by_parameter_order, so SQLAlchemy
+                # falls back to one INSERT ... RETURNING per row (see the docstring)
+                assert inserts == 250
+            assert len(set(ids)) == 250
+            chunks = {c.id: c for c in DocumentChunk.query.filter(DocumentChunk.id.in_(ids))}
+            assert [chunks[i].chunk_index for i in ids] == list(range(250))
+            assert all(chunks[i].document_id == test_document.id for i in ids)
+
+    def test_insert_nothing(self, app, test_document):
+        """Test an empty chunk list inserts nothing"""
+        from src.database import insert_document_chunks
+        with app.app_context():
+            assert insert_document_chunks(test_document.id, []) == []
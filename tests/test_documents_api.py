@@ -1,8 +1,10 @@
 """Tests for document management API"""
 import pytest
 import json
+import uuid
 from io import BytesIO
 from src.database import db, Document, DocumentChunk
+from tests.test_utils import RecordingStore, chunk_loader, sse_events, three_chunks, unique_pdf_bytes
 
 
 class TestDocumentUpload:
@@ -26,6 +28,219 @@ class TestDocumentUpload:
         response = authenticated_client.post('/api/upload', data=data, content_type='multipart/form-data')
         assert response.status_code == 400
 
+    def test_upload_returns_job_and_indexes_in_background(self, authenticated_client, app, upload_pdf,
+                                                          recording_store):
+        """Test upload answers with a job ID and the ingestion job records its outcome"""
+        response = upload_pdf()
+        assert response.status_code == 202
+        job_id = json.loads(response.data)['job_id']
+
+        status = json.loads(authenticated_client.get(f'/api/documents/{job_id}/status').data)
+        assert status['status'] == 'indexed'
+        assert status['chunks'] == 3
+
+        with app.app_context():
+            chunk_ids = {str(c.id) for c in DocumentChunk.query.filter_by(document_id=job_id)}
+        added = recording_store.metadatas
+        assert {m['chunk_id'] for m in added} == chunk_ids
+        assert all(m['document_id'] == str(job_id) for m in added)
+
+    def test_chunks_record_deterministic_vector_ids(self, authenticated_client, app, upload_pdf,
+                                                    recording_store):
+        """Test each chunk's vector ID is derived from its document and index and stored on the row"""
+        job_id = json.loads(upload_pdf().data)['job_id']
+
+        expected = [f"doc-{job_id}-{i}" for i in range(3)]
+        assert recording_store.ids == expected
+        with app.app_context():
+            chunks = DocumentChunk.query.filter_by(document_id=job_id).order_by(DocumentChunk.chunk_index)
+            assert [c.pinecone_id for c in chunks] == expected
+
+        authenticated_client.delete(f'/api/documents/{job_id}')
+        assert recording_store.deletes == [(expected, None)]
+
+    def test_failed_ingestion_deletes_sent_vectors_by_id(self, authenticated_client, upload_pdf,
+                                                         recording_store, monkeypatch):
+        """Test vectors upserted before a failure are removed by their IDs"""
+        import src.ingestion as ingestion_module
+        monkeypatch.setattr(ingestion_module, 'EMBED_BATCH_SIZE', 2)
+
+        def failing_loader(path, progress=None, executor=None):
+            yield from three_chunks(path)[:2]
+            raise ValueError("corrupt page")
+
+        job_id = json.loads(upload_pdf(filename='broken.pdf', loader=failing_loader).data)['job_id']
+
+        status = json.loads(authenticated_client.get(f'/api/documents/{job_id}/status').data)
+        assert status['status'] == 'failed'
+        assert recording_store.deletes == [([f"doc-{job_id}-0", f"doc-{job_id}-1"], None)]
+
+    def test_progress_stream_reports_counters(self, authenticated_client, upload_pdf):
+        """Test the progress stream ends with the pipeline's final counters"""
+        job_id = json.loads(upload_pdf().data)['job_id']
+
+        response = authenticated_client.get(f'/api/documents/{job_id}/progress')
+        assert response.mimetype == 'text/event-stream'
+        events = sse_events(response)
+        assert events[-1]['type'] == 'done'
+        assert events[-1]['status'] == 'indexed'
+        assert events[-1]['pages_total'] == 3
+        assert events[-1]['chunks_created'] == 3
+        assert events[-1]['chunks_embedded'] == 3
+        assert events[-1]['vectors_upserted'] == 3
+
+    def test_ingestion_streams_chunks_in_batches(self, app, upload_pdf, recording_store, monkeypatch):
+        """Test chunks indexed across several batches keep their order and count"""
+        import src.ingestion as ingestion_module
+        monkeypatch.setattr(ingestion_module, 'EMBED_BATCH_SIZE', 2)
+
+        job_id = json.loads(upload_pdf().data)['job_id']
+
+        with app.app_context():
+            chunks = DocumentChunk.query.filter_by(document_id=job_id).order_by(DocumentChunk.id).all()
+            assert [c.chunk_index for c in chunks] == [0, 1, 2]
+            assert [c.page_number for c in chunks] == [0, 1, 2]
+        assert [m['page'] for m in recording_store.metadatas] == [0, 1, 2]
+
+    def test_same_file_twice_returns_existing_document(self, app, upload_pdf, recording_store):
+        """Test re-uploading identical bytes neither stores nor indexes a second copy"""
+        content, loader = unique_pdf_bytes(), chunk_loader(uuid.uuid4().hex)
+        first = upload_pdf(content, 'a.pdf', loader)
+        second = upload_pdf(content, 'b.pdf', loader)
+        assert second.status_code == 200
+        assert json.loads(second.data)['duplicate'] is True
+        assert json.loads(second.data)['job_id'] == json.loads(first.data)['job_id']
+        assert len(recording_store.embeddings.texts) == 3
+        with app.app_context():
+            assert Document.query.filter_by(original_filename='b.pdf').count() == 0
+
+    def test_identical_chunks_reuse_embeddings(self, authenticated_client, app, upload_pdf,
+                                               recording_store):
+        """Test a different file with already indexed chunk texts is not embedded again"""
+        loader = chunk_loader(uuid.uuid4().hex)
+        for _ in range(2):
+            response = upload_pdf(loader=loader)
+            assert response.status_code == 202
+        job_id = json.loads(response.data)['job_id']
+
+        assert len(recording_store.embeddings.texts) == 3
+        assert len(recording_store.metadatas) == 6
+        status = json.loads(authenticated_client.get(f'/api/documents/{job_id}/status').data)
+        assert status['status'] == 'indexed'
+        with app.app_context():
+            hashes = [c.content_hash for c in DocumentChunk.query.filter_by(document_id=job_id)]
+        assert len(set(hashes)) == 3
+
+    def test_stale_in_flight_upload_is_failed_and_can_be_reuploaded(self, app, test_user, upload_pdf):
+        """Test a job lost to a restart is marked failed and no longer blocks the same file"""
+        from datetime import datetime, timedelta
+        from src.database import DocumentStatus
+        from src.ingestion import fail_stale_documents, INTERRUPTED_ERROR
+
+        content = unique_pdf_bytes()
+        hour_ago = datetime.utcnow() - timedelta(hours=1)
+        with app.app_context():
+            from src.ingestion import file_sha256
+            stale = Document(user_id=test_user.id, filename='s.pdf', original_filename='s.pdf',
+                             file_path='/test/s.pdf', content_hash=file_sha256(BytesIO(content)),
+                             status=DocumentStatus.PROCESSING, uploaded_at=hour_ago, updated_at=hour_ago)
+            live = Document(user_id=test_user.id, filename='l.pdf', original_filename='l.pdf',
+                            file_path='/test/l.pdf', status=DocumentStatus.PROCESSING)
+            db.session.add_all([stale, live])
+            db.session.flush()
+            db.session.add(DocumentChunk(document_id=stale.id, chunk_index=0, pinecone_id=f"doc-{stale.id}-0"))
+            db.session.commit()
+            stale_id, live_id = stale.id, live.id
+
+        response = upload_pdf(content, 's.pdf', chunk_loader(uuid.uuid4().hex))
+        assert response.status_code == 202
+        assert json.loads(response.data)['job_id'] != stale_id
+
+        with app.app_context():
+            store = RecordingStore()
+            assert stale_id in fail_stale_documents(store)
+            assert store.deletes == [([f"doc-{stale_id}-0"], None)]
+            assert db.session.get(Document, stale_id).status == DocumentStatus.FAILED
+            assert db.session.get(Document, stale_id).error == INTERRUPTED_ERROR
+            assert DocumentChunk.query.filter_by(document_id=stale_id).count() == 0
+            assert db.session.get(Document, live_id).status == DocumentStatus.PROCESSING
+            Document.query.filter(Document.id.in_([stale_id, live_id])).delete()
+            db.session.commit()
+
+    def test_status_fails_job_lost_after_startup(self, authenticated_client, app, test_user,
+                                                 recording_store):
+        """Test a job that went stale after the startup sweep is failed when its status is read"""
+        from datetime import datetime, timedelta
+        from src.database import DocumentStatus
+        from src.ingestion import INTERRUPTED_ERROR
+
+        hour_ago = datetime.utcnow() - timedelta(hours=1)
+        with app.app_context():
+            doc = Document(user_id=test_user.id, filename='k.pdf', original_filename='k.pdf',
+                           file_path='/test/k.pdf', status=DocumentStatus.PROCESSING,
+                           uploaded_at=hour_ago, updated_at=hour_ago)
+            db.session.add(doc)
+            db.session.flush()
+            db.session.add(DocumentChunk(document_id=doc.id, chunk_index=0, pinecone_id=f"doc-{doc.id}-0"))
+            db.session.commit()
+            doc_id = doc.id
+
+        status = json.loads(authenticated_client.get(f'/api/documents/{doc_id}/status').data)
+        assert status['status'] == 'failed'
+        assert status['error'] == INTERRUPTED_ERROR
+        assert status['chunks'] == 0
+        assert recording_store.deletes == [([f"doc-{doc_id}-0"], None)]
+
+        events = sse_events(authenticated_client.get(f'/api/documents/{doc_id}/progress'))
+        assert events[-1]['type'] == 'done'
+        assert events[-1]['status'] == 'failed'
+
+        with app.app_context():
+            Document.query.filter_by(id=doc_id).delete()
+            db.session.commit()
+
+    def test_progress_stream_ends_before_worker_timeout(self, authenticated_client, app, test_user,
+                                                        monkeypatch):
+        """Test an unfinished upload's stream ends on its own and tells the browser to reconnect"""
+        from src.database import DocumentStatus
+        import app as app_module
+        monkeypatch.setattr(app_module, 'PROGRESS_STREAM_TIMEOUT', 0)
+
+        with app.app_context():
+            doc = Document(user_id=test_user.id, filename='p.pdf', original_filename='p.pdf',
+                           file_path='/test/p.pdf', status=DocumentStatus.PROCESSING)
+            db.session.add(doc)
+            db.session.commit()
+            doc_id = doc.id
+
+        response = authenticated_client.get(f'/api/documents/{doc_id}/progress')
+        body = response.data.decode()
+        assert body.startswith(f'retry: {app_module.PROGRESS_RETRY_MS}\n\n')
+        assert 'data: ' not in body
+
+        with app.app_context():
+            Document.query.filter_by(id=doc_id).delete()
+            db.session.commit()
+
+    def test_progress_of_other_users_document(self, authenticated_client):
+        """Test the progress stream only serves the caller's documents"""
+        response = authenticated_client.get('/api/documents/99999/progress')
+        assert response.status_code == 404
+
+    def test_upload_of_empty_pdf_fails_job(self, authenticated_client, upload_pdf):
+        """Test a PDF without text ends in the failed state with a reason"""
+        response = upload_pdf(filename='empty.pdf', loader=lambda path, progress=None, executor=None: [])
+        job_id = json.loads(response.data)['job_id']
+
+        status = json.loads(authenticated_client.get(f'/api/documents/{job_id}/status').data)
+        assert status['status'] == 'failed'
+        assert 'empty' in status['error']
+
+    def test_status_of_other_users_document(self, authenticated_client):
+        """Test the status endpoint only reports the caller's documents"""
+        response = authenticated_client.get('/api/documents/99999/status')
+        assert response.status_code == 404
+
 
 class TestDocumentDeletion:
     """Tests for document deletion"""
@@ -97,3 +312,16 @@ class TestDocumentDeletion:
             # Chunk should be deleted via cascade
             deleted_chunk = DocumentChunk.query.get(chunk_id)
             assert deleted_chunk is None, f"Chunk {chunk_id} should be deleted via cascade but still exists"
+
+    def test_delete_legacy_chunks_uses_filter(self, authenticated_client, app, test_document,
+                                              recording_store):
+        """Test chunks without recorded vector IDs are deleted by document_id filter"""
+        with app.app_context():
+            test_document = db.session.merge(test_document)
+            db.session.add(DocumentChunk(document_id=test_document.id, chunk_index=0, content_preview="Test"))
+            db.session.commit()
+            doc_id = test_document.id
+
+        response = authenticated_client.delete(f'/api/documents/{doc_id}')
+        assert response.status_code == 200
+        assert recording_store.deletes == [(None, {"document_id": str(doc_id)})]
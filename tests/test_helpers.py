@@ -1,7 +1,8 @@
 """Tests for helper functions"""
 import pytest
 from langchain_core.documents import Document
-from src.helper import filter_to_minimal_docs, text_split, download_hugging_face_embeddings
+from src.helper import (filter_to_minimal_docs, text_split, download_hugging_face_embeddings,
+                        iter_text_chunks, batched)
 
 
 class TestDocumentFiltering:
@@ -48,6 +49,22 @@ class TestTextSplitting:
         assert all(chunk.metadata.get("source") == "test.pdf" for chunk in chunks)
         assert all(chunk.metadata.get("page") == 5 for chunk in chunks)
 
+    def test_iter_text_chunks_matches_text_split(self):
+        """Test streaming splitting yields text_split's chunks and counts them"""
+        docs = [Document(page_content=f"Page {i}. " + "word " * 300, metadata={"source": "a.pdf", "page": i})
+                for i in range(3)]
+        counts = []
+        chunks = iter_text_chunks(iter(docs), progress=lambda counter, value: counts.append(value))
+
+        assert list(chunks) == text_split(docs)
+        assert counts[-1] == len(text_split(docs))
+        assert counts == sorted(counts)
+
+    def test_batched(self):
+        """Test batches keep order and the last one may be short"""
+        assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(batched([], 3)) == []
+
 
 class TestEmbeddings:
     """Tests for embedding functions"""
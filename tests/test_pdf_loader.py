@@ -0,0 +1,73 @@
+"""Tests for parallel PDF page extraction"""
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from src.pdf_loader import load_pdf_pages, page_ranges, pdf_metadata
+from tests.test_utils import write_text_pdf
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = str(tmp_path / "book.pdf")
+    write_text_pdf(path, [f"page {i} text" for i in range(40)])
+    return path
+
+
+class TestPageRanges:
+    """Tests for splitting a page range into tasks"""
+
+    def test_ranges_cover_every_page_once(self):
+        """Test ranges are contiguous, ordered and bounded by the task count"""
+        ranges = page_ranges(10, 4)
+        assert ranges == [(0, 3), (3, 6), (6, 9), (9, 10)]
+        assert page_ranges(3, 8) == [(0, 1), (1, 2), (2, 3)]
+        assert page_ranges(0, 4) == []
+
+
+class TestLoadPdfPages:
+    """Tests for load_pdf_pages"""
+
+    def test_serial_extraction(self, pdf_path):
+        """Test one Document per page with source/page metadata"""
+        pages = load_pdf_pages(pdf_path, processes=1)
+        assert [p.page_content for p in pages[:2]] == ["page 0 text", "page 1 text"]
+        assert pages[7].metadata == {"producer": "PyPDF", "creator": "PyPDF", "creationdate": "",
+                                     "source": pdf_path, "total_pages": 40, "page": 7, "page_label": "8"}
+
+    def test_matches_pypdfloader(self, pdf_path):
+        """Test the pages are the Documents PyPDFLoader produced before"""
+        from langchain_community.document_loaders import PyPDFLoader
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            parallel = load_pdf_pages(pdf_path, executor=executor)
+        assert parallel == PyPDFLoader(pdf_path).load()
+
+    def test_pdf_info_metadata(self):
+        """Test info dictionary entries are normalised like PyPDFLoader's"""
+        from pypdf.generic import NameObject, TextStringObject
+
+        class Reader:
+            pages = [None] * 2
+            metadata = {NameObject("/Producer"): TextStringObject(" Writer 1.0 "),
+                        NameObject("/CreationDate"): TextStringObject("D:20240131120000+01'00'"),
+                        NameObject("/Title"): TextStringObject("Guide")}
+
+        assert pdf_metadata(Reader(), "guide.pdf") == {
+            "producer": "Writer 1.0", "creator": "PyPDF", "creationdate": "2024-01-31T12:00:00+01:00",
+            "title": "Guide", "source": "guide.pdf", "total_pages": 2}
+
+    def test_executor_matches_serial(self, pdf_path):
+        """Test extraction on a pool keeps page order and output"""
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            parallel = load_pdf_pages(pdf_path, executor=executor)
+        assert parallel == load_pdf_pages(pdf_path, processes=1)
+
+    def test_process_pool_matches_serial(self, pdf_path):
+        """Test a temporary process pool gives the same Documents"""
+        assert load_pdf_pages(pdf_path, processes=2) == load_pdf_pages(pdf_path, processes=1)
+
+    def test_reports_page_progress(self, pdf_path):
+        """Test pages_total is reported first and pages_parsed ends at the page count"""
+        events = []
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            load_pdf_pages(pdf_path, executor=executor, progress=lambda *event: events.append(event))
+        assert events[0] == ("pages_total", 40)
+        assert events[-1] == ("pages_parsed", 40)
@@ -0,0 +1,80 @@
+"""Tests for write-behind persistence"""
+import pytest
+import threading
+from src.persistence import WriteBehindQueue
+
+
+class TestWriteBehindQueue:
+    """Tests for the bounded write-behind queue"""
+
+    def test_submit_does_not_wait_for_job(self):
+        """Test submit returns while a queued job is still running"""
+        release = threading.Event()
+        done = []
+
+        def slow_write(value):
+            release.wait(5)
+            done.append(value)
+
+        writes = WriteBehindQueue(maxsize=4, workers=1)
+        writes.submit(slow_write, 1)
+        assert done == []
+
+        release.set()
+        writes.flush()
+        assert done == [1]
+        writes.close()
+
+    def test_full_queue_runs_inline(self):
+        """Test a job is run in the caller when the queue has no room"""
+        started = threading.Event()
+        release = threading.Event()
+        threads = []
+
+        def blocker():
+            started.set()
+            release.wait(5)
+
+        def write():
+            threads.append(threading.current_thread().name)
+
+        writes = WriteBehindQueue(maxsize=1, workers=1)
+        writes.submit(blocker)
+        started.wait(5)
+        writes.submit(write)
+        writes.submit(write)
+        assert threads == [threading.current_thread().name]
+
+        release.set()
+        writes.close()
+        assert len(threads) == 2
+
+    def test_close_drains_pending_jobs(self):
+        """Test close finishes every queued job before returning"""
+        done = []
+        writes = WriteBehindQueue(maxsize=16, workers=2)
+        for i in range(10):
+            writes.submit(done.append, i)
+        writes.close()
+        assert sorted(done) == list(range(10))
+
+    def test_failing_job_does_not_stop_worker(self):
+        """Test an exception in one job leaves the worker running"""
+        done = []
+
+        def broken():
+            raise RuntimeError("database unavailable")
+
+        writes = WriteBehindQueue(maxsize=4, workers=1)
+        writes.submit(broken)
+        writes.submit(done.append, "after")
+        writes.flush()
+        assert done == ["after"]
+        writes.close()
+
+    def test_zero_workers_is_synchronous(self):
+        """Test workers=0 runs each job before submit returns"""
+        done = []
+        writes = WriteBehindQueue(workers=0)
+        writes.submit(done.append, 1)
+        assert done == [1]
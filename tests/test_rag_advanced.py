@@ -0,0 +1,159 @@
+"""Tests for advanced RAG helpers"""
+import pytest
+import time
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable
+from src import rag_advanced
+from src.rag_advanced import rewrite_query, is_specific_query, retrieve_with_rewrite
+
+
+class RewritingLLM(Runnable):
+    """LLM stub that counts calls and can be slowed down"""
+
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        original = input.to_messages()[-1].content.split("Original query: ")[1].split("\n")[0]
+        return f"rewritten {original}"
+
+
+@pytest.fixture(autouse=True)
+def clear_rewrite_cache():
+    rag_advanced._rewrite_cache.clear()
+    yield
+    rag_advanced._rewrite_cache.clear()
+
+
+class TestQueryRewrite:
+    """Tests for query rewriting shortcuts"""
+
+    def test_rewrite_cache_uses_normalized_key(self):
+        """Test a case/whitespace variant reuses the earlier rewrite"""
+        llm = RewritingLLM()
+        first = rewrite_query(llm, "Symptoms of diabetes")
+        second = rewrite_query(llm, "  symptoms OF diabetes ")
+        assert first == second
+        assert llm.calls == 1
+
+    def test_is_specific_query(self):
+        """Test the bypass heuristic"""
+        assert is_specific_query("What are the early symptoms of type 2 diabetes")
+        assert not is_specific_query("diabetes symptoms")
+        assert not is_specific_query("How long should I take it for after the surgery")
+
+    def test_cached_mode_bypasses_specific_queries(self):
+        """Test specific queries are retrieved as-is without an LLM call"""
+        llm = RewritingLLM()
+        timings = {}
+        query = "What are the early symptoms of type 2 diabetes"
+        docs, used = retrieve_with_rewrite(llm, lambda q: [q], query, mode="cached", timings=timings)
+        assert used == query
+        assert docs == [query]
+        assert llm.calls == 0
+        assert timings["rewrite"] == "bypass"
+
+    def test_always_mode_rewrites(self):
+        """Test always mode calls the LLM and records the rewrite time"""
+        llm = RewritingLLM()
+        timings = {}
+        docs, used = retrieve_with_rewrite(llm, lambda q: [q], "flu", mode="always", timings=timings)
+        assert used == "rewritten flu"
+        assert timings["rewrite"] == "llm"
+        assert timings["rewrite_ms"] >= 0
+
+    def test_race_mode_returns_first_result(self):
+        """Test race mode answers with the original query when the rewrite is slow"""
+        llm = RewritingLLM(delay=0.3)
+        timings = {}
+        start = time.perf_counter()
+        docs, used = retrieve_with_rewrite(llm, lambda q: [q], "flu", mode="race", timings=timings)
+        assert time.perf_counter() - start < 0.25
+        assert used == "flu"
+        assert timings["rewrite"] == "race-original"
+
+        time.sleep(0.4)
+        docs, used = retrieve_with_rewrite(llm, lambda q: [q], "flu", mode="race")
+        assert used == "rewritten flu"
+
+    def test_race_mode_skips_retrieval_for_late_rewrite(self):
+        """Test the original query is retrieved on the caller's thread and a late rewrite retrieves nothing"""
+        import threading
+        llm = RewritingLLM(delay=0.2)
+        calls = []
+
+        def retriever(query):
+            calls.append((query, threading.current_thread()))
+            return [query]
+
+        retrieve_with_rewrite(llm, retriever, "flu", mode="race")
+        time.sleep(0.3)
+        assert calls == [("flu", threading.current_thread())]
+        assert rag_advanced.get_cached_rewrite("flu") == "rewritten flu"
+
+    def test_race_mode_uses_ready_rewrite_and_times_it(self):
+        """Test a rewrite finished before the original retrieval is used and its latency recorded"""
+        llm = RewritingLLM(delay=0.05)
+
+        def slow_retriever(query):
+            time.sleep(0.2)
+            return [query]
+
+        timings = {}
+        docs, used = retrieve_with_rewrite(llm, slow_retriever, "flu", mode="race", timings=timings)
+        assert used == "rewritten flu"
+        assert docs == ["rewritten flu"]
+        assert timings["rewrite"] == "race-rewritten"
+        assert timings["rewrite_ms"] >= 50
+
+
+class MultiHopLLM(Runnable):
+    """LLM stub that splits every question into three sub-questions"""
+
+    def invoke(self, input, config=None, **kwargs):
+        prompt = input.to_messages()[-1].content
+        if prompt.startswith("Original query:"):
+            return "rewritten query"
+        if prompt.startswith("Question:"):
+            return 'MULTI_HOP: ["hop one", "hop two", "hop three"]'
+        return "final answer"
+
+
+class TestMultiHopReasoning:
+    """Tests for multi-hop retrieval"""
+
+    def test_sub_questions_retrieved_concurrently_in_order(self):
+        """Test hop latency is bounded by the slowest hop and order is kept"""
+        delays = {"hop one": 0.3, "hop two": 0.1, "hop three": 0.2}
+
+        def retriever(query):
+            time.sleep(delays.get(query, 0))
+            return [Document(page_content=query)]
+
+        start = time.perf_counter()
+        result = rag_advanced.multi_hop_reasoning(
+            MultiHopLLM(), retriever, "compare these drugs", max_hops=3)
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.55
+        assert result["answer"] == "final answer"
+        assert result["reasoning_chain"] == [
+            "rewritten query", "hop one", "hop two", "hop three"]
+        assert [d.page_content for d in result["context_used"]] == [
+            "rewritten query", "hop one", "hop two", "hop three"]
+
+    def test_stream_reports_progress_and_streams_synthesis(self):
+        """Test the stream emits a status per stage and hop, then answer tokens"""
+        events = list(rag_advanced.multi_hop_reasoning_stream(
+            MultiHopLLM(), lambda q: [Document(page_content=q)], "compare these drugs", max_hops=2))
+
+        stages = [e["stage"] for e in events if e["type"] == "status"]
+        assert stages == ["rewriting", "retrieving", "analyzing", "retrieving_hops",
+                          "retrieving_hops", "retrieving_hops", "synthesizing"]
+        tokens = [e["content"] for e in events if e["type"] == "token"]
+        assert "".join(tokens) == "final answer"
+        assert events[-1]["type"] == "result"
+        assert events[-1]["reasoning_chain"] == ["rewritten query", "hop one", "hop two"]
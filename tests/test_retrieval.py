@@ -0,0 +1,36 @@
+"""Tests for retrieval helpers"""
+import pytest
+import time
+from src.retrieval import parallel_retrieve
+
+
+class TestParallelRetrieve:
+    """Tests for concurrent retriever fan-out"""
+
+    def test_results_keep_retriever_order(self):
+        """Test results come back in the order retrievers were given"""
+        def slow(query):
+            time.sleep(0.1)
+            return ["slow:" + query]
+
+        def fast(query):
+            return ["fast:" + query]
+
+        results = parallel_retrieve([slow, fast], "q")
+        assert results == [["slow:q"], ["fast:q"]]
+
+    def test_none_retriever_returns_empty(self):
+        """Test a missing retriever contributes an empty result"""
+        results = parallel_retrieve([lambda q: [q], None], "q")
+        assert results == [["q"], []]
+
+    def test_retrievals_run_concurrently(self):
+        """Test latency is bounded by the slowest retriever, not the sum"""
+        def slow(query):
+            time.sleep(0.3)
+            return [query]
+
+        start = time.perf_counter()
+        parallel_retrieve([slow, slow], "q")
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.55
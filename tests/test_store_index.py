@@ -0,0 +1,86 @@
+"""Tests for incremental corpus indexing in store_index.py"""
+import os
+import pytest
+import store_index
+from src.vector_store import LocalVectorStore
+from tests.test_utils import write_text_pdf
+
+
+class CountingEmbeddings:
+    """Two-dimensional embeddings that record every embedded text"""
+
+    def __init__(self):
+        self.texts = []
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [self.embed_query(text) for text in texts]
+
+
+class FlakyStore(LocalVectorStore):
+    """LocalVectorStore whose upserts fail after `fail_after` calls"""
+    fail_after = None
+
+    def add_embeddings(self, *args, **kwargs):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise ConnectionError("upsert failed")
+            self.fail_after -= 1
+        return super().add_embeddings(*args, **kwargs)
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_index, 'EMBED_BATCH_SIZE', 2)
+    data = tmp_path / "data"
+    data.mkdir()
+    write_text_pdf(str(data / "a.pdf"), [f"alpha page {i}" for i in range(5)])
+    write_text_pdf(str(data / "b.pdf"), [f"beta page {i}" for i in range(3)])
+    store = FlakyStore(CountingEmbeddings(), str(tmp_path / "index"))
+    return store, str(data), str(tmp_path / "manifest.json")
+
+
+def run(store, data, manifest, **kwargs):
+    return store_index.index_corpus(store, data=data, manifest_path=manifest, target="test",
+                                    processes=1, **kwargs)
+
+
+class TestIndexCorpus:
+    """Tests for index_corpus"""
+
+    def test_rerun_skips_unchanged_files(self, corpus):
+        """Test a second run embeds nothing"""
+        store, data, manifest = corpus
+        assert run(store, data, manifest)["chunks"] == 8
+        assert run(store, data, manifest) == {"indexed": 0, "removed": 0, "unchanged": 2, "chunks": 0}
+        assert len(store.embeddings.texts) == 8
+        assert len(store) == 8
+
+    def test_changed_and_deleted_files(self, corpus):
+        """Test only the changed file is re-indexed and a deleted file's vectors go away"""
+        store, data, manifest = corpus
+        run(store, data, manifest)
+        write_text_pdf(os.path.join(data, "a.pdf"), ["alpha rewritten"])
+        os.remove(os.path.join(data, "b.pdf"))
+
+        summary = run(store, data, manifest)
+        assert summary == {"indexed": 1, "removed": 1, "unchanged": 0, "chunks": 1}
+        assert sorted(doc.page_content for doc in store.similarity_search("x", k=10)) == ["alpha rewritten"]
+
+    def test_resume_after_failed_upsert(self, corpus):
+        """Test an interrupted run continues after the last upserted batch without duplicates"""
+        store, data, manifest = corpus
+        store.fail_after = 1
+        with pytest.raises(ConnectionError):
+            run(store, data, manifest)
+        assert len(store) == 2
+
+        store.fail_after = None
+        store.embeddings.texts.clear()
+        summary = run(store, data, manifest)
+        assert summary["chunks"] == 6
+        assert "alpha page 0" not in store.embeddings.texts
+        assert len(store) == 8
@@ -1,4 +1,11 @@
 """Utility functions for tests"""
+import json
+import uuid
+from contextlib import contextmanager
+from langchain_core.documents import Document as LCDocument
+from sqlalchemy import event
+
+
 def consume_stream(response):
     """Consume a streaming response to prevent hanging"""
     if hasattr(response, 'response') and hasattr(response.response, '__iter__'):
@@ -6,3 +13,98 @@ def consume_stream(response):
             list(response.response)
         except Exception:
             pass
+
+
+def sse_events(response):
+    """Decode the JSON `data:` events of a Server-Sent Events response"""
+    return [json.loads(line[6:]) for line in response.get_data(as_text=True).splitlines()
+            if line.startswith('data: ')]
+
+
+class RecordingEmbeddings:
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class RecordingStore:
+    """Vector store stand-in that records what ingestion embeds and upserts"""
+
+    def __init__(self):
+        self.embeddings = RecordingEmbeddings()
+        self.metadatas = []
+        self.ids = []
+        self.deletes = []
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        self.metadatas.extend(metadatas)
+        self.ids.extend(ids)
+
+    def delete(self, ids=None, filter=None):
+        self.deletes.append((ids, filter))
+
+
+def chunk_loader(prefix):
+    """load_document_chunks stand-in returning three one-page chunks"""
+    def load(path, progress=None, executor=None):
+        if progress is not None:
+            progress("pages_total", 3)
+            progress("pages_parsed", 3)
+            progress("chunks_created", 3)
+        return [LCDocument(page_content=f"{prefix} chunk {i}", metadata={"source": path, "page": i})
+                for i in range(3)]
+    return load
+
+
+three_chunks = chunk_loader("guide")
+
+
+def unique_pdf_bytes():
+    # Uploads are deduplicated by content hash, so each test sends its own file
+    return f"%PDF-1.4 {uuid.uuid4()}".encode()
+
+
+@contextmanager
+def count_queries(engine):
+    """Count SQL statements executed on `engine` inside the block"""
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_execute)
+
+
+def write_text_pdf(path, page_texts):
+    """Write a minimal PDF with one line of Helvetica text per page"""
+    n = len(page_texts)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(
+            b"%d 0 R" % (4 + 2 * i) for i in range(n)) + b"] /Count %d >>" % n,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        stream = b"BT /F1 12 Tf 72 720 Td (" + text.encode("latin-1") + b") Tj ET"
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
@@ -0,0 +1,295 @@
+"""Tests for the local vector store backend"""
+import pytest
+import numpy as np
+from langchain_core.documents import Document
+from src.vector_store import (LocalVectorStore, match_filter, upsert_embeddings, embed_and_upsert,
+                              delete_ids, document_vector_ids)
+
+
+class KeywordEmbeddings:
+    """Deterministic bag-of-words embeddings for tests"""
+    VOCAB = ["diabetes", "insulin", "glucose", "hypertension", "blood", "pressure",
+             "asthma", "lungs", "fever", "infection"]
+
+    def embed_query(self, text):
+        words = text.lower().split()
+        return [float(words.count(w)) + 0.01 for w in self.VOCAB]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "index"))
+    store.add_documents([
+        Document(page_content="diabetes insulin glucose", metadata={"user_id": "global", "document_id": "1"}),
+        Document(page_content="hypertension blood pressure", metadata={"user_id": "7", "document_id": "2"}),
+        Document(page_content="asthma lungs", metadata={"user_id": "8", "document_id": "3"}),
+    ])
+    return store
+
+
+class TestLocalVectorStore:
+    """Tests for LocalVectorStore"""
+
+    def test_similarity_search_ranks_by_cosine(self, store):
+        """Test the closest chunk is returned first"""
+        results = store.similarity_search("blood pressure", k=2)
+        assert results[0].page_content == "hypertension blood pressure"
+        assert len(results) == 2
+
+    def test_filter_in_operator(self, store):
+        """Test $in filters restrict results to visible users"""
+        results = store.similarity_search("blood pressure", k=5,
+                                          filter={"user_id": {"$in": ["8", "global"]}})
+        assert {d.metadata["user_id"] for d in results} == {"8", "global"}
+
+    def test_retriever_passes_filter(self, store):
+        """Test as_retriever search_kwargs are honoured"""
+        retriever = store.as_retriever(search_kwargs={"k": 3, "filter": {"user_id": "8"}})
+        results = retriever.invoke("lungs")
+        assert [d.page_content for d in results] == ["asthma lungs"]
+
+    def test_delete_by_filter_persists(self, store, tmp_path):
+        """Test deletes by metadata filter survive reopening the index"""
+        store.delete(filter={"document_id": "2"})
+        assert len(store) == 2
+
+        reopened = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "index"))
+        contents = [d.page_content for d in reopened.similarity_search("blood pressure", k=5)]
+        assert "hypertension blood pressure" not in contents
+        assert len(contents) == 2
+
+    def test_add_with_existing_id_replaces(self, store):
+        """Test re-adding an id overwrites the previous vector"""
+        store.add_texts(["fever infection"], [{"user_id": "global"}], ids=["fixed"])
+        store.add_texts(["asthma lungs"], [{"user_id": "global"}], ids=["fixed"])
+        assert len(store) == 4
+        assert store.get_by_ids(["fixed"])[0].page_content == "asthma lungs"
+
+    def test_unencodable_record_leaves_files_aligned(self, store, tmp_path):
+        """Test a record that fails to serialise writes no vector either"""
+        with pytest.raises(TypeError):
+            store.add_texts(["fever"], [{"bad": object()}])
+        store.add_texts(["fever infection"], [{"user_id": "global"}], ids=["after"])
+
+        reopened = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "index"))
+        doc, score = reopened.similarity_search_with_score("fever infection", k=1)[0]
+        assert doc.id == "after"
+        assert score == pytest.approx(1.0, abs=1e-5)
+
+    def test_vectors_without_records_are_truncated(self, store, tmp_path):
+        """Test vectors left by a crash before their records were written are dropped"""
+        with open(tmp_path / "index" / "vectors.f32", "ab") as f:
+            f.write(np.ones(len(KeywordEmbeddings.VOCAB), dtype=np.float32).tobytes())
+        store.add_texts(["asthma lungs fever"], [{"user_id": "global"}], ids=["after"])
+
+        reopened = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "index"))
+        assert len(reopened) == 4
+        doc, score = reopened.similarity_search_with_score("asthma lungs fever", k=1)[0]
+        assert doc.id == "after"
+        assert score == pytest.approx(1.0, abs=1e-5)
+
+    def test_ivf_matches_exact_top_hit(self, tmp_path):
+        """Test IVF search finds the same nearest neighbour as exact search"""
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(2000, 16)).astype(np.float32)
+        ivf = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "ivf"), index_type="ivf")
+        ivf.add_embeddings([f"text {i}" for i in range(2000)], vectors,
+                           ids=[str(i) for i in range(2000)])
+        assert ivf._centroids is not None
+
+        for i in (3, 500, 1999):
+            doc, score = ivf.similarity_search_by_vector_with_score(vectors[i].tolist(), k=1)[0]
+            assert doc.id == str(i)
+            assert score == pytest.approx(1.0, abs=1e-5)
+
+
+class TestUpsertEmbeddings:
+    """Tests for writing precomputed vectors"""
+
+    def test_local_store_keeps_vectors(self, store):
+        """Test precomputed vectors are searchable in a LocalVectorStore"""
+        vector = store.embeddings.embed_query("fever")
+        upsert_embeddings(store, ["fever notes"], [vector], [{"page": 1}], ids=["a"])
+        doc, score = store.similarity_search_by_vector_with_score(vector, k=1)[0]
+        assert doc.page_content == "fever notes"
+        assert score == pytest.approx(1.0, abs=1e-5)
+
+    def test_pinecone_style_store_upserts_text_in_metadata(self):
+        """Test stores without add_embeddings are upserted through their index client"""
+        class Index:
+            def upsert(self, vectors, namespace=None):
+                self.vectors, self.namespace = vectors, namespace
+
+        class PineconeLike:
+            _index, _text_key, _namespace = Index(), "text", "docs"
+
+        store = PineconeLike()
+        upsert_embeddings(store, ["a"], [np.ones(2)], [{"page": 2}], ids=["x"])
+        assert store._index.vectors == [{"id": "x", "values": [1.0, 1.0], "metadata": {"page": 2, "text": "a"}}]
+        assert store._index.namespace == "docs"
+
+    def test_embed_and_upsert_batches_in_order(self, tmp_path):
+        """Test batched embedding writes every chunk once and reports final counters"""
+        store = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "batched"))
+        texts = [f"fever {'infection ' * (i % 3)}note {i}" for i in range(10)]
+        counters = {}
+        stats = embed_and_upsert(store, texts, [{"n": i} for i in range(10)],
+                                 ids=[str(i) for i in range(10)], batch_size=4, upsert_batch_size=3,
+                                 progress=counters.__setitem__)
+        assert stats["chunks"] == 10
+        assert counters == {"chunks_embedded": 10, "vectors_upserted": 10}
+        assert len(store) == 10
+        assert [d.metadata["n"] for d in store.get_by_ids(["0", "9"])] == [0, 9]
+        assert store.get_by_ids(["7"])[0].page_content == texts[7]
+
+    def test_failed_upsert_request_is_retried_alone(self, tmp_path, monkeypatch):
+        """Test only the failed upsert request is re-sent and no vector is duplicated"""
+        import src.vector_store as vector_store_module
+        monkeypatch.setattr(vector_store_module.time, 'sleep', lambda seconds: None)
+
+        class FlakyStore(LocalVectorStore):
+            calls = []
+
+            def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+                self.calls.append(list(ids))
+                if len(self.calls) == 2:
+                    # Part of the request lands before the connection drops
+                    super().add_embeddings(texts[:1], embeddings[:1], metadatas=metadatas[:1], ids=ids[:1])
+                    raise ConnectionError("connection reset")
+                return super().add_embeddings(texts, embeddings, metadatas=metadatas, ids=ids)
+
+        store = FlakyStore(KeywordEmbeddings(), str(tmp_path / "flaky"))
+        ids = document_vector_ids(5, 0, 6)
+        embed_and_upsert(store, [f"fever note {i}" for i in range(6)], [{"n": i} for i in range(6)],
+                         ids=ids, batch_size=6, upsert_batch_size=2)
+        assert store.calls == [ids[0:2], ids[2:4], ids[2:4], ids[4:6]]
+        assert len(store) == 6
+
+    def test_delete_ids_in_batches(self, store):
+        """Test deletes by ID are split into bounded requests"""
+        store.add_texts([f"fever {i}" for i in range(5)], ids=document_vector_ids(9, 0, 5))
+        requests = []
+        original = store.delete
+        store.delete = lambda ids=None, **kwargs: requests.append(ids) or original(ids=ids, **kwargs)
+        delete_ids(store, document_vector_ids(9, 0, 5), batch_size=2)
+        assert requests == [["doc-9-0", "doc-9-1"], ["doc-9-2", "doc-9-3"], ["doc-9-4"]]
+        assert len(store) == 3
+
+
+class TestMatchFilter:
+    """Tests for Pinecone-style filter evaluation"""
+
+    def test_operators(self):
+        """Test equality, $in, $ne and $or conditions"""
+        meta = {"user_id": "7", "page": 3}
+        assert match_filter(meta, {"user_id": "7"})
+        assert match_filter(meta, {"user_id": {"$in": ["7", "global"]}})
+        assert not match_filter(meta, {"user_id": {"$ne": "7"}})
+        assert match_filter(meta, {"$or": [{"user_id": "8"}, {"page": {"$gte": 3}}]})
+
+
+class TestHNSWIndex:
+    """Tests for the HNSW approximate index"""
+
+    def test_recall_against_exact(self):
+        """Test HNSW recall@5 is high on clustered data"""
+        from src.ann_index import HNSWIndex, recall_at_k
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(600, 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = HNSWIndex(M=8, ef_construction=64)
+        for row in range(len(vectors)):
+            index.add(row, vectors)
+
+        queries = vectors[:50]
+        exact = [np.argsort(-(vectors @ q))[:5].tolist() for q in queries]
+        approx = [[row for _, row in index.search(q, vectors, 5, ef=64)] for q in queries]
+        assert recall_at_k(approx, exact) >= 0.95
+
+    def test_hnsw_store_skips_tombstones(self, tmp_path):
+        """Test deleted rows never appear and incremental inserts are searchable after reload"""
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(300, 16)).astype(np.float32)
+        path = str(tmp_path / "hnsw")
+        store = LocalVectorStore(KeywordEmbeddings(), path, index_type="hnsw")
+        store.add_embeddings([f"text {i}" for i in range(200)], vectors[:200],
+                             ids=[str(i) for i in range(200)])
+        store.add_embeddings([f"text {i}" for i in range(200, 300)], vectors[200:],
+                             ids=[str(i) for i in range(200, 300)])
+        store.delete(ids=["42"])
+        store.flush()
+
+        reopened = LocalVectorStore(KeywordEmbeddings(), path, index_type="hnsw")
+        assert len(reopened._hnsw) == 300
+        top = reopened.similarity_search_by_vector(vectors[42].tolist(), k=3)
+        assert "42" not in [d.id for d in top]
+        assert reopened.similarity_search_by_vector(vectors[250].tolist(), k=1)[0].id == "250"
+
+    def test_hnsw_reader_scans_unsaved_rows_instead_of_inserting(self, tmp_path):
+        """Test another instance searches rows missing from the saved graph exactly, without inserting them"""
+        rng = np.random.default_rng(4)
+        vectors = rng.normal(size=(300, 16)).astype(np.float32)
+        path = str(tmp_path / "hnsw")
+        writer = LocalVectorStore(KeywordEmbeddings(), path, index_type="hnsw")
+        reader = LocalVectorStore(KeywordEmbeddings(), path, index_type="hnsw")
+        writer.add_embeddings([f"text {i}" for i in range(300)], vectors, ids=[str(i) for i in range(300)])
+        assert len(writer._hnsw) == 300
+
+        assert reader.similarity_search_by_vector(vectors[250].tolist(), k=1)[0].id == "250"
+        assert len(reader._hnsw) == 0
+
+        writer.flush()
+        assert reader.similarity_search_by_vector(vectors[42].tolist(), k=1)[0].id == "42"
+        assert len(reader._hnsw) == 300
+
+    def test_hnsw_searches_run_concurrently(self, tmp_path):
+        """Test one query's graph walk does not wait for another's"""
+        import threading
+        rng = np.random.default_rng(2)
+        vectors = rng.normal(size=(50, 16)).astype(np.float32)
+        store = LocalVectorStore(KeywordEmbeddings(), str(tmp_path / "hnsw"), index_type="hnsw")
+        store.add_embeddings([f"text {i}" for i in range(50)], vectors, ids=[str(i) for i in range(50)])
+
+        both_inside = threading.Barrier(2, timeout=5)
+        original = store._hnsw.search
+
+        def search(*args, **kwargs):
+            both_inside.wait()
+            return original(*args, **kwargs)
+        store._hnsw.search = search
+
+        results = {}
+
+        def query(i):
+            results[i] = store.similarity_search_by_vector(vectors[i].tolist(), k=1)[0].id
+        threads = [threading.Thread(target=query, args=(i,)) for i in (3, 7)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == {3: "3", 7: "7"}
+
+    def test_hnsw_graph_saved_every_n_rows_and_on_flush(self, tmp_path, monkeypatch):
+        """Test the graph is not re-pickled on every append, and flush saves the rest"""
+        import src.vector_store as vector_store_module
+        monkeypatch.setattr(vector_store_module, 'HNSW_SAVE_EVERY', 250)
+        rng = np.random.default_rng(3)
+        vectors = rng.normal(size=(300, 16)).astype(np.float32)
+        path = tmp_path / "hnsw"
+        store = LocalVectorStore(KeywordEmbeddings(), str(path), index_type="hnsw")
+        for start in range(0, 200, 100):
+            store.add_embeddings([f"text {i}" for i in range(start, start + 100)], vectors[start:start + 100],
+                                 ids=[str(i) for i in range(start, start + 100)])
+        assert not (path / "hnsw.pkl").exists()
+
+        store.add_embeddings([f"text {i}" for i in range(200, 300)], vectors[200:],
+                             ids=[str(i) for i in range(200, 300)])
+        assert (path / "hnsw.pkl").exists()
+        store.delete(ids=["0"])
+        store.add_embeddings(["text 0"], vectors[:1], ids=["0"])
+        store.flush()
+        reopened = LocalVectorStore(KeywordEmbeddings(), str(path), index_type="hnsw")
+        assert reopened._hnsw_saved_rows == 301